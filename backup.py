@@ -1,20 +1,34 @@
 #!/usr/bin/python3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from mysql.connector import errors, errorcode
+from mysql.connector.constants import FieldType
 import argparse
 import configparser
+import copy
 import logging
 import logging.handlers
 import mysql.connector
 import os
 import pwd
 import grp
+import gzip
+import hashlib
+import io
+import json
+import queue
 import re
 import shutil
 import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
 import time
 import traceback
+import zlib
 
 SQL_RETRY_ATTEMPTS = 5
 SecureFilePriv = '/home'
@@ -27,12 +41,1357 @@ retry_errors = (
     errorcode.ER_QUERY_INTERRUPTED,
 )
 
+CLIENT_KEYS = ('user', 'password', 'socket', 'host', 'port')
+# engines which keep UPDATE_TIME of information_schema up to date, a table of another engine is never reused
+UPDATE_TIME_ENGINES = ('innodb', 'myisam', 'aria')
+INTEGER_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'bigint')
+# columns enclosed in quotes by OPTIONALLY ENCLOSED BY
+ENCLOSED_FIELD_TYPES = set(FieldType.get_string_types() + FieldType.get_binary_types() + [FieldType.SET, FieldType.JSON])
+ESCAPE_PATTERN = re.compile(rb'[\\\t\n\0]')
+# inside enclosed fields OUTFILE escapes the enclosing quote and the line terminator
+CSV_ESCAPE_PATTERN = re.compile(rb'[\\"\n\0]')
+
 
 def die(message):
     logging.critical(message)
     raise ValueError(message)
 
 
+def parse_size(value):
+    match = re.fullmatch(r'\s*(\d+)\s*([KMGT]?)B?\s*', str(value), re.IGNORECASE)
+    if not match:
+        die(f"Can not parse size '{value}', expected number with optional K, M, G or T suffix")
+    return int(match.group(1)) * 1024 ** ' KMGT'.index(match.group(2).upper() or ' ')
+
+
+def escape_field(match):
+    # the zero byte is written as \0, other special characters are prefixed with the escape character
+    return b'\\0' if match.group() == b'\0' else b'\\' + match.group()
+
+
+def encode_rows(batches, enclosed=None):
+    """Encodes batches of raw rows the way SELECT ... INTO OUTFILE writes them.
+
+    Without `enclosed` the default tab separated format is used, otherwise the format of `Backup.inline_sql`,
+    where `enclosed` tells which columns are quoted. Yields one block of bytes per batch.
+    """
+    for rows in batches:
+        lines = []
+        for row in rows:
+            fields = []
+            for index, value in enumerate(row):
+                if value is None:
+                    fields.append(b'\\N')
+                elif enclosed is None:
+                    fields.append(ESCAPE_PATTERN.sub(escape_field, value) if ESCAPE_PATTERN.search(value) else bytes(value))
+                elif enclosed[index]:
+                    fields.append(b'"' + CSV_ESCAPE_PATTERN.sub(escape_field, value) + b'"')
+                else:
+                    fields.append(bytes(value))
+            lines.append((b'\t' if enclosed is None else b';').join(fields))
+        yield b'\n'.join(lines) + b'\n'
+
+
+class CountingWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.stream.write(data)
+
+    def close(self):
+        self.stream.close()
+
+
+class HashingReader:
+    """File read by tar, the checksum of what is read is computed on the way."""
+
+    def __init__(self, file):
+        self.file = file
+        self.hash = Checksums.hasher()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.hash.update(data)
+        self.size += len(data)
+        return data
+
+
+class Checksums:
+    """Size, blake2b and rows of every file of a database backup, saved as the last member of its archive for `--verify`.
+
+    `stored` tells where the file is: in the `archive`, compressed on its own in the backup `directory` or in `chunks`.
+    """
+    member = 'checksums.json'
+
+    def __init__(self, files=None, tables=None):
+        self.files = files or {}
+        self.tables = tables or {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def hasher():
+        return hashlib.blake2b(digest_size=32)
+
+    @classmethod
+    def loads(cls, data):
+        data = json.loads(data)
+        return cls(data['files'], data['tables'])
+
+    def dumps(self):
+        with self.lock:
+            return json.dumps({'algorithm': 'blake2b', 'files': self.files, 'tables': self.tables}, indent=1, sort_keys=True)
+
+    def add(self, arcname, **values):
+        with self.lock:
+            self.files.setdefault(str(arcname), {}).update(values)
+
+    def add_table(self, table_name, **values):
+        with self.lock:
+            self.tables.setdefault(table_name, {}).update(values)
+
+    def get(self, arcname):
+        with self.lock:
+            return dict(self.files.get(str(arcname), {}))
+
+    def first_export(self, table_name):
+        """True for the first export of the table, its checksum is read once even when it is split."""
+        with self.lock:
+            if table_name in self.tables:
+                return False
+            self.tables[table_name] = {}
+            return True
+
+    def track(self, arcname, blocks, stored):
+        """Passes the blocks through, the checksum of the file is recorded after the last one."""
+        digest = self.hasher()
+        size = 0
+        for block in blocks:
+            digest.update(block)
+            size += len(block)
+            yield block
+        self.add(arcname, size=size, blake2b=digest.hexdigest(), stored=stored)
+
+
+class RowCounter:
+    """Rows of a data file read in blocks, a line feed after an odd number of backslashes is escaped and does not end a row."""
+    escaped = re.compile(rb'(?<!\\)(?:\\\\)*\\\n')
+
+    def __init__(self):
+        self.rows = 0
+        self.carry = b''
+
+    def add(self, block):
+        # an odd run of backslashes at the end of the block escapes the first byte of the next one
+        data = self.carry + block
+        self.rows += data.count(b'\n') - len(self.escaped.findall(data))
+        self.carry = b'\\' if (len(data) - len(data.rstrip(b'\\'))) % 2 else b''
+
+
+class RateLimiter:
+    """Keeps the bytes passed by all threads under `rate` per second, short bursts of up to a second are allowed."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, size):
+        with self.lock:
+            now = time.monotonic()
+            self.next_time = max(self.next_time, now - 1) + size / self.rate
+            delay = self.next_time - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+class LimitedWriter:
+    def __init__(self, stream, limiter):
+        self.stream = stream
+        self.limiter = limiter
+
+    def write(self, data):
+        self.limiter.consume(len(data))
+        return self.stream.write(data)
+
+    def close(self):
+        self.stream.close()
+
+
+class PipeWriter:
+    """Feeds an external compressor, its output goes to the archive file."""
+
+    def __init__(self, command, path, append=False):
+        logging.debug(f"Executing command: {command}")
+        self.command = command
+        self.file = open(path, 'ab' if append else 'wb')
+        self.process = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE, stdout=self.file, stderr=subprocess.PIPE)
+
+    def write(self, data):
+        return self.process.stdin.write(data)
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        finally:
+            stderr = self.process.stderr.read()
+            return_code = self.process.wait()
+            self.file.close()
+        if return_code:
+            die(f"Error running command '{self.command}': {stderr.decode(errors='replace').strip()}")
+
+
+class PipeReader:
+    """Reads the output of an external decompressor, `length` bytes of the file from `offset` when they are set."""
+
+    def __init__(self, command, path, offset=0, length=None):
+        if length is not None:
+            command = f'head -c {length} | {command}'
+        logging.debug(f"Executing command: {command}")
+        self.command = command
+        self.file = open(path, 'rb')
+        self.file.seek(offset)
+        self.process = subprocess.Popen(command, shell=True, stdin=self.file, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def read(self, size=-1):
+        return self.process.stdout.read(size)
+
+    def close(self):
+        try:
+            self.process.stdout.close()
+        finally:
+            stderr = self.process.stderr.read()
+            return_code = self.process.wait()
+            self.file.close()
+        if return_code:
+            die(f"Error running command '{self.command}': {stderr.decode(errors='replace').strip()}")
+
+
+class FileRange:
+    """Reads `length` bytes of the file from `offset`, the rest of the file when `length` is None."""
+
+    def __init__(self, path, offset=0, length=None):
+        self.file = open(path, 'rb')
+        self.file.seek(offset)
+        self.left = length
+
+    def read(self, size=-1):
+        if self.left is not None:
+            size = self.left if size < 0 else min(size, self.left)
+        data = self.file.read(size)
+        if self.left is not None:
+            self.left -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class GzipRangeReader(gzip.GzipFile):
+    """Reads gzip members stored in a range of the file, multi-member files of pgzip included."""
+
+    def __init__(self, path, offset=0, length=None):
+        self.range = FileRange(path, offset, length)
+        super().__init__(fileobj=self.range, mode='rb')
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.range.close()
+
+
+class ParallelGzipWriter:
+    """Compresses blocks of the stream on several cores, every block becomes a separate gzip member.
+
+    Concatenated gzip members are a valid gzip file, so the result is readable by `tar -xzf`.
+    """
+    block_size = 1024 * 1024
+
+    def __init__(self, path, level, threads, append=False):
+        self.file = open(path, 'ab' if append else 'wb')
+        self.level = level
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.max_pending = threads * 2
+        self.pending = deque()
+        self.buffer = bytearray()
+
+    def compress_block(self, block):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress(block) + compressor.flush()
+
+    def submit(self, block):
+        self.pending.append(self.pool.submit(self.compress_block, block))
+        while len(self.pending) > self.max_pending:
+            self.file.write(self.pending.popleft().result())
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        try:
+            if self.buffer and not self.pending:
+                # a small file is compressed without starting a thread
+                self.file.write(self.compress_block(bytes(self.buffer)))
+            elif self.buffer:
+                self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+            while self.pending:
+                self.file.write(self.pending.popleft().result())
+        finally:
+            self.pool.shutdown()
+            self.file.close()
+
+
+class Compressor:
+    extension = 'tgz'
+    file_extension = 'gz'
+    default_level = 6
+    # archive size of a typical dump to its data, for planning the space of the first backup
+    ratio = 0.3
+
+    def __init__(self, level=None, threads=None, nice='', rate=None):
+        self.level = level or self.default_level
+        self.threads = threads or os.cpu_count() or 1
+        self.nice = nice
+        self.limiter = RateLimiter(rate) if rate else None
+
+    def writer(self, path, append=False):
+        """Stream of the compressor, the input is limited to `rate` bytes per second when it is set."""
+        return self.limit(self.open(path, append))
+
+    def member_writer(self, path):
+        """Stream of one member appended to an indexed archive."""
+        return self.limit(self.open_member(path))
+
+    def limit(self, stream):
+        return LimitedWriter(stream, self.limiter) if self.limiter else stream
+
+    def open(self, path, append=False):
+        return PipeWriter(f'{self.nice} gzip -{self.level} -c', path, append)
+
+    def open_member(self, path):
+        # an archive has a member per folder and file, gzip is not started for each of them
+        return ParallelGzipWriter(path, self.level, self.threads, append=True)
+
+    def open_reader(self, path, offset=0, length=None):
+        return GzipRangeReader(path, offset, length)
+
+
+class ParallelGzipCompressor(Compressor):
+    def open(self, path, append=False):
+        return ParallelGzipWriter(path, self.level, self.threads, append)
+
+
+class ZstdCompressor(Compressor):
+    extension = 'tar.zst'
+    file_extension = 'zst'
+    default_level = 3
+    ratio = 0.25
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not shutil.which('zstd'):
+            die("zstd compressor requires `zstd` to be installed")
+
+    def open(self, path, append=False):
+        ultra = '--ultra ' if self.level > 19 else ''
+        return PipeWriter(f'{self.nice} zstd -q {ultra}-{self.level} -T{self.threads} -c', path, append)
+
+    def open_member(self, path):
+        return self.open(path, append=True)
+
+    def open_reader(self, path, offset=0, length=None):
+        return PipeReader(f'{self.nice} zstd -q -d -c', path, offset, length)
+
+
+class NoCompressor(Compressor):
+    extension = 'tar'
+    file_extension = None
+    ratio = 1.0
+
+    def open(self, path, append=False):
+        return open(path, 'ab' if append else 'wb')
+
+    def open_member(self, path):
+        return self.open(path, append=True)
+
+    def open_reader(self, path, offset=0, length=None):
+        return FileRange(path, offset, length)
+
+
+class ArchiveWriter:
+    """Tar archive streamed through the compressor, files may be added from several threads."""
+
+    def __init__(self, path, compressor, checksums=None):
+        self.path = path
+        self.start_time = time.time()
+        self.checksums = checksums or Checksums()
+        self.stream = CountingWriter(compressor.writer(path))
+        self.tar = tarfile.open(fileobj=self.stream, mode='w|', dereference=True)
+        self.lock = threading.Lock()
+
+    def add_member(self, path, arcname):
+        """Adds the file, or the folder without its content, the checksum of the file is computed while tar reads it."""
+        info = self.tar.gettarinfo(path, str(arcname))
+        if not info.isreg():
+            self.tar.addfile(info)
+            return
+        with open(path, 'rb') as file:
+            reader = HashingReader(file)
+            self.tar.addfile(info, reader)
+        self.checksums.add(arcname, size=reader.size, blake2b=reader.hash.hexdigest(), stored='archive')
+
+    def add_checksums(self):
+        data = self.checksums.dumps().encode()
+        info = tarfile.TarInfo(Checksums.member)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def add_entry(self, path, arcname):
+        self.add_member(path, arcname)
+        if Path(path).is_dir():
+            for child in sorted(Path(path).iterdir()):
+                self.add_entry(child, f'{arcname}/{child.name}')
+
+    def add(self, path, arcname, remove=False):
+        with self.lock:
+            self.add_entry(path, arcname)
+        if remove:
+            os.unlink(path)
+
+    def close(self):
+        try:
+            self.add_checksums()
+            self.tar.close()
+        finally:
+            self.stream.close()
+
+    def discard(self):
+        try:
+            self.close()
+        except Exception as e:
+            logging.debug(f'Error closing discarded archive {self.path}: {e}')
+        if Path(self.path).exists():
+            Path(self.path).unlink()
+
+    def throughput(self):
+        duration = max(time.time() - self.start_time, 0.001)
+        raw_mb = self.stream.bytes / 1024 ** 2
+        compressed_mb = Path(self.path).stat().st_size / 1024 ** 2
+        return f"{raw_mb:.1f} MB -> {compressed_mb:.1f} MB, {raw_mb / duration:.1f} MB/s"
+
+
+class SegmentStream:
+    """Position of the tar stream which is written to a new compressor stream for every segment."""
+
+    def __init__(self):
+        self.stream = None
+        self.bytes = 0
+
+    def write(self, data):
+        self.bytes += len(data)
+        return self.stream.write(data)
+
+    def tell(self):
+        return self.bytes
+
+
+class IndexedArchiveWriter(ArchiveWriter):
+    """Tar archive where every file is compressed on its own, gzip members or zstd frames are concatenated.
+
+    The result is still readable by `tar -xf`, while the offsets saved in `<archive>.index.json`
+    let one table be read without decompressing the rest of the archive.
+    """
+
+    def __init__(self, path, compressor, checksums=None):
+        self.path = Path(path)
+        self.compressor = compressor
+        self.start_time = time.time()
+        self.checksums = checksums or Checksums()
+        self.path.write_bytes(b'')
+        self.stream = SegmentStream()
+        self.tar = tarfile.open(fileobj=self.stream, mode='w', dereference=True)
+        self.index = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def index_path(path):
+        return Path(f'{path}.index.json')
+
+    def segment(self, write):
+        """Compresses what `write` adds to the tar as a separate member, returns its offset and length."""
+        offset = self.path.stat().st_size
+        self.stream.stream = self.compressor.member_writer(self.path)
+        try:
+            write()
+        finally:
+            self.stream.stream.close()
+        return {'offset': offset, 'length': self.path.stat().st_size - offset}
+
+    def add_member(self, path, arcname):
+        self.index[str(arcname)] = self.segment(lambda: super(IndexedArchiveWriter, self).add_member(path, arcname))
+
+    def close(self):
+        self.index[Checksums.member] = self.segment(self.add_checksums)
+        # the end of archive blocks are the last member
+        self.segment(self.tar.close)
+        index_path = self.index_path(self.path)
+        with open(index_path.with_suffix('.tmp'), 'w') as file:
+            json.dump({'extension': self.compressor.extension, 'files': self.index}, file, indent=2)
+        os.replace(index_path.with_suffix('.tmp'), index_path)
+
+    def discard(self):
+        super().discard()
+        if self.index_path(self.path).exists():
+            self.index_path(self.path).unlink()
+
+
+class DataDirectory:
+    """Keeps every data file compressed on its own, so the next backup can hard link the unchanged ones."""
+
+    def __init__(self, path, compressor, checksums=None):
+        self.path = Path(path)
+        self.compressor = compressor
+        self.checksums = checksums or Checksums()
+
+    @staticmethod
+    def stored_name(arcname, extension):
+        return f'{arcname}.{extension}' if extension else str(arcname)
+
+    def target(self, arcname):
+        target = self.path / self.stored_name(arcname, self.compressor.file_extension)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        return target
+
+    def clear(self, db_name):
+        if (self.path / db_name).exists():
+            shutil.rmtree(self.path / db_name)
+
+    def add(self, path, arcname, remove=False):
+        with open(path, 'rb') as file:
+            target = self.write(arcname, iter(lambda: file.read(1024 * 1024), b''))
+        if remove:
+            os.unlink(path)
+        return target
+
+    def write(self, arcname, blocks):
+        """Writes the file next to the target and moves it in place.
+
+        The target may be a hard link to the file of the previous backup, e.g. a table linked and then exported again
+        by a retry, writing into it would change the previous backup.
+        """
+        target = self.target(arcname)
+        temp_path = target.with_name(f'{target.name}.tmp')
+        stream = self.compressor.writer(temp_path)
+        try:
+            try:
+                for block in self.checksums.track(arcname, blocks, 'directory'):
+                    stream.write(block)
+            finally:
+                stream.close()
+            os.replace(temp_path, target)
+        except BaseException:
+            if temp_path.exists():
+                temp_path.unlink()
+            raise
+        return target
+
+    def link(self, source, arcname):
+        target = self.target(arcname)
+        if target.exists():
+            target.unlink()
+        os.link(source, target)
+
+
+class ImportScripts:
+    """Import scripts of a database in `folder`, the section of every table is written as soon as the table is added.
+
+    `<db>.sql` loads the tables and builds their indexes, the foreign keys and ANALYZE follow all tables; `fast` puts
+    the structure, LOAD DATA, indexes, ANALYZE and foreign keys into five numbered scripts and `oft` writes a script
+    per table. The foreign keys wait in a spooled file, not in memory. Every script is fsynced once, when it is complete.
+    """
+    spool_size = 1024 * 1024
+
+    def __init__(self, folder, db_name, fast=False, oft=False, rocksdb=False):
+        self.folder = Path(folder)
+        self.db_name = db_name
+        self.fast = fast
+        self.oft = oft
+        self.rocksdb = rocksdb
+        self.tables = []
+        self.files = []
+        self.scripts = {}
+        self.foreign_keys = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for file in self.scripts.values():
+            file.close()
+        self.scripts = {}
+        if self.foreign_keys:
+            self.foreign_keys.close()
+            self.foreign_keys = None
+
+    def open(self, phase, name):
+        self.scripts[phase] = open(self.folder / name, 'w')
+        self.files.append(name)
+        return self.scripts[phase]
+
+    def sync(self, phase):
+        file = self.scripts.pop(phase)
+        file.flush()
+        os.fsync(file.fileno())
+        file.close()
+
+    def header(self):
+        header = f'CREATE DATABASE IF NOT EXISTS `{self.db_name}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;\n'
+        header += f'USE `{self.db_name}`;\n'
+        if self.rocksdb:
+            header += 'SET session sql_log_bin=0;\n'
+            header += 'SET session rocksdb_bulk_load=1;\n\n'
+        return header
+
+    def add_table(self, table_name, structure, load_sql, indexes, foreign_keys):
+        if self.oft:
+            self.open('import', f"{self.db_name}_{table_name}.sql").write(self.header())
+        elif not self.tables:
+            self.open('import', f"1.{self.db_name}_structure.sql" if self.fast else f"{self.db_name}.sql").write(self.header())
+            if self.fast:
+                self.open('load', f"2.{self.db_name}_load.sql")
+                self.open('index', f"3.{self.db_name}_index.sql")
+        self.tables.append(table_name)
+        script = self.scripts['import']
+        script.write(f' {table_name} '.center(60, '#') + '\n')
+        script.write(f'DROP TABLE IF EXISTS `{table_name}`;\n')
+        script.write(f'{structure};\n')
+        if self.fast:
+            self.scripts['load'].write(f"{load_sql}\n")
+        else:
+            script.write(f"\n{load_sql}\n")
+        if indexes:
+            (self.scripts['index'] if self.fast else script).write(f'{indexes}\n')
+        if foreign_keys:
+            # added after all tables are loaded, without checks the keys are added in place and the data is not scanned
+            if not self.foreign_keys:
+                self.foreign_keys = tempfile.SpooledTemporaryFile(self.spool_size, 'w+')
+                self.foreign_keys.write('SET session foreign_key_checks=0;\n')
+            self.foreign_keys.write(f'{foreign_keys}\n')
+        if self.oft:
+            self.finish(f"`{table_name}`")
+
+    def write_foreign_keys(self, script):
+        self.foreign_keys.write('SET session foreign_key_checks=1;\n')
+        self.foreign_keys.seek(0)
+        shutil.copyfileobj(self.foreign_keys, script)
+        self.foreign_keys.close()
+        self.foreign_keys = None
+
+    def finish(self, tables):
+        """Ends the scripts of the tables added since the last call."""
+        script = self.scripts['import']
+        if self.rocksdb:
+            script.write('SET session rocksdb_bulk_load=0;\n')
+        if self.foreign_keys and not self.fast:
+            script.write('\n')
+            self.write_foreign_keys(script)
+        analyze_sql = f"\nANALYZE NO_WRITE_TO_BINLOG TABLE {tables};\n\n"
+        if self.fast:
+            self.sync('load')
+            self.sync('index')
+            self.open('analyze', f"4.{self.db_name}_analyze.sql").write(analyze_sql)
+            self.sync('analyze')
+            foreign_keys_script = self.open('foreign_keys', f"5.{self.db_name}_foreign_keys.sql")
+            if self.foreign_keys:
+                foreign_keys_script.write(f'USE `{self.db_name}`;\n')
+                self.write_foreign_keys(foreign_keys_script)
+            self.sync('foreign_keys')
+        else:
+            script.write(analyze_sql)
+        self.sync('import')
+
+    def close(self):
+        if self.tables and not self.oft:
+            self.finish(','.join(f"`{table_name}`" for table_name in self.tables))
+
+
+class Manifest:
+    """Fingerprints and data files of the tables of one database backup, saved next to its archive."""
+
+    def __init__(self, db_name, directory, extension, tables=None, created=None):
+        self.db_name = db_name
+        self.directory = Path(directory)
+        self.extension = extension
+        self.tables = tables or {}
+        self.created = created or datetime.now().isoformat(timespec='seconds')
+
+    @staticmethod
+    def file_path(directory, db_name):
+        return Path(directory) / f'{db_name}.manifest.json'
+
+    @classmethod
+    def latest(cls, backup_dir, db_name, exclude):
+        """Manifest of the most recent backup of the database, the folder `exclude` is skipped."""
+        if not Path(backup_dir).is_dir():
+            return None
+        manifests = [cls.file_path(folder, db_name) for folder in Path(backup_dir).iterdir() if folder.is_dir() and folder != exclude]
+        manifests = [manifest for manifest in manifests if manifest.is_file()]
+        if not manifests:
+            return None
+        return cls.load(max(manifests, key=os.path.getmtime), db_name)
+
+    @classmethod
+    def load(cls, path, db_name):
+        try:
+            with open(path) as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Can not read manifest {path}: {e}")
+            return None
+        return cls(db_name, Path(path).parent, data.get('extension'), data.get('tables'), data.get('created'))
+
+    def save(self):
+        path = self.file_path(self.directory, self.db_name)
+        temp_path = path.with_suffix('.tmp')
+        data = {'database': self.db_name, 'created': self.created, 'extension': self.extension, 'tables': self.tables}
+        with open(temp_path, 'w') as file:
+            json.dump(data, file, indent=2, sort_keys=True)
+        os.replace(temp_path, path)
+
+    def add_table(self, table_name, fingerprint, files):
+        self.tables[table_name] = {'fingerprint': fingerprint, 'files': files}
+
+    def stored_path(self, arcname):
+        return self.directory / DataDirectory.stored_name(arcname, self.extension)
+
+    def reusable_partitions(self, table_name, fingerprint, partitions, extension):
+        """Data files of the partitions not changed since this backup, while other partitions of the table have changed.
+
+        A partition is unchanged when its UPDATE_TIME and row estimate are the same and the table has the same DDL.
+        """
+        table = self.tables.get(table_name)
+        if not table or not table['fingerprint'] or not fingerprint or extension != self.extension:
+            return []
+        if table['fingerprint'].get('ddl') != fingerprint.get('ddl'):
+            return []
+        return [file for file in table['files']
+                if file.get('fingerprint') and file['fingerprint'].get('update_time') and file['fingerprint'].get('fresh')
+                and file['fingerprint'] == partitions.get(file['chunk']) and self.stored_path(file['file']).is_file()]
+
+    def reusable(self, table_name, fingerprint, extension):
+        """Data files of the table when it has not changed since this backup, otherwise None."""
+        table = self.tables.get(table_name)
+        if not table or not fingerprint or not fingerprint.get('update_time') or extension != self.extension:
+            return None
+        if table['fingerprint'] != fingerprint:
+            return None
+        if not all(self.stored_path(file['file']).is_file() for file in table['files']):
+            return None
+        return table['files']
+
+
+class DedupStore:
+    """Data files cut into chunks at content defined boundaries, every chunk is stored once in a folder shared by all backups.
+
+    A boundary follows a line whose crc32 is below `threshold` once the chunk has `min_size` bytes, so an inserted or
+    deleted row changes only the chunk around it. The backup of a database is the list of chunks of its data files.
+    """
+    min_size = 256 * 1024
+    max_size = 8 * 1024 * 1024
+    threshold = 2 ** 32 // 2048
+
+    def __init__(self, path, db_name, directory, level=None, checksums=None):
+        self.path = Path(path)
+        self.db_name = db_name
+        self.directory = Path(directory)
+        self.level = level
+        self.checksums = checksums or Checksums()
+        self.files = {}
+        self.size = 0
+        self.stored = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def file_path(directory, db_name):
+        return Path(directory) / f'{db_name}.chunks.json'
+
+    @staticmethod
+    def chunk_path(path, digest, compressed):
+        return Path(path) / digest[:2] / (f'{digest}.gz' if compressed else digest)
+
+    @classmethod
+    def split(cls, file):
+        chunk = bytearray()
+        for line in file:
+            chunk += line
+            if len(chunk) >= cls.max_size or len(chunk) >= cls.min_size and zlib.crc32(line) < cls.threshold:
+                yield bytes(chunk)
+                chunk = bytearray()
+        if chunk:
+            yield bytes(chunk)
+
+    def store(self, chunk):
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self.chunk_path(self.path, digest, self.level is not None)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            data = gzip.compress(chunk, self.level) if self.level is not None else chunk
+            temp_path = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+            with self.lock:
+                self.stored += len(data)
+        else:
+            # chunks still referenced are not collected as garbage by a run started before this one
+            os.utime(path)
+        return [digest, len(chunk)]
+
+    def add(self, path, arcname, remove=False):
+        with open(path, 'rb') as file:
+            chunks = [self.store(chunk) for chunk in self.split(self.checksums.track(arcname, file, 'chunks'))]
+        with self.lock:
+            self.files[str(arcname)] = chunks
+            self.size += sum(size for _, size in chunks)
+        if remove:
+            os.unlink(path)
+        return None
+
+    def save(self):
+        path = self.file_path(self.directory, self.db_name)
+        temp_path = path.with_suffix('.tmp')
+        data = {'database': self.db_name, 'created': datetime.now().isoformat(timespec='seconds'),
+                'compressed': self.level is not None, 'files': self.files}
+        with open(temp_path, 'w') as file:
+            json.dump(data, file, indent=1, sort_keys=True)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Can not read chunk list {path}: {e}")
+            return None
+
+    @classmethod
+    def collect_garbage(cls, backup_dir, started):
+        """Removes the chunks no chunk list in the folders of `backup_dir` refers to.
+
+        Chunks touched since `started` are kept, a backup running at the same time may not have saved its list yet.
+        """
+        path = Path(backup_dir) / 'chunks'
+        if not path.is_dir():
+            return
+        references = {}
+        for chunk_list in Path(backup_dir).glob(f'*/{cls.file_path("", "*")}'):
+            data = cls.load(chunk_list)
+            if data is None:
+                logging.warning("Unreferenced chunks are kept as the references are not known")
+                return
+            for chunks in data['files'].values():
+                for digest, _ in chunks:
+                    references[digest] = references.get(digest, 0) + 1
+        removed = freed = 0
+        for chunk in path.glob('*/*'):
+            digest = chunk.name.split('.')[0]
+            if references.get(digest) or chunk.stat().st_mtime >= started:
+                continue
+            freed += chunk.stat().st_size
+            chunk.unlink()
+            removed += 1
+        logging.info(f"Removed {removed} unreferenced chunks, {freed / 1024 ** 2:.1f} MB, {len(references)} chunks in use")
+
+    def message(self):
+        return f", {self.stored / 1024 ** 2:.1f} MB of new chunks for {self.size / 1024 ** 2:.1f} MB of data"
+
+
+class Checkpoint:
+    """Exports finished for a database, a retry or a rerun after a crash skips them.
+
+    Saved as JSON lines, the start of the first attempt and then a line appended for every finished file.
+    A file is recorded with the DDL hash of its table in `structures`, it is exported again after an ALTER TABLE.
+    """
+
+    def __init__(self, path, files=None, started=None):
+        self.path = Path(path)
+        self.files = files or {}
+        self.structures = {}
+        self.lock = threading.Lock()
+        if started is None:
+            self.started = time.time()
+            with open(self.path, 'w') as file:
+                file.write(json.dumps({'started': self.started}) + '\n')
+        else:
+            self.started = started
+
+    @classmethod
+    def load(cls, path, max_age):
+        """Checkpoint saved by an earlier attempt, the one older than `max_age` seconds is not trusted."""
+        path = Path(path)
+        if path.is_file():
+            try:
+                with open(path) as file:
+                    started = json.loads(file.readline())['started']
+                    files = {}
+                    for line in file:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            # the line being written when the backup was stopped
+                            continue
+                        files[entry.pop('file')] = entry
+                if time.time() - started < max_age:
+                    return cls(path, files, started)
+                logging.info(f"Checkpoint {path} is too old, exporting the database from scratch")
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logging.warning(f"Can not read checkpoint {path}: {e}")
+        return cls(path)
+
+    def condition(self, table_name, condition):
+        return {'where': condition, 'ddl': self.structures.get(table_name)}
+
+    def add(self, path, table_name, condition, checksums=None):
+        """Records the finished file with its size and mtime and the checksums computed while it was written."""
+        stat = path.stat()
+        entry = {'condition': self.condition(table_name, condition), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'checksums': checksums or {}}
+        line = json.dumps({'file': str(path), **entry}) + '\n'
+        with self.lock:
+            self.files[str(path)] = entry
+            with open(self.path, 'a') as file:
+                file.write(line)
+
+    def done(self, path, table_name, condition):
+        """True when the file was exported with the same condition and DDL and has not been changed since."""
+        entry = self.files.get(str(path))
+        if not entry or entry['condition'] != self.condition(table_name, condition) or not path.is_file():
+            return False
+        stat = path.stat()
+        return (stat.st_size, stat.st_mtime_ns) == (entry['size'], entry['mtime_ns'])
+
+    def remove(self):
+        if self.path.exists():
+            self.path.unlink()
+
+
+class Throttle:
+    """Limits how many exports run at once by the load of the server.
+
+    The server is sampled at most every `interval` seconds before an export starts. Under the limits one more
+    worker is allowed, over them the workers are halved, and at twice the limits the exports pause.
+    """
+
+    def __init__(self, connect, jobs, max_threads_running=None, max_replica_lag=None, max_pool_reads=None, interval=5):
+        self.connect = connect
+        self.jobs = jobs
+        self.limits = {'threads_running': max_threads_running, 'replica_lag': max_replica_lag, 'pool_reads': max_pool_reads}
+        self.interval = interval
+        self.enabled = any(self.limits.values())
+        self.allowed = jobs
+        self.active = 0
+        self.conn = None
+        self.cursor = None
+        self.sampled = None
+        self.pool_reads = None
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        with self.condition:
+            while True:
+                if not self.sampled or time.monotonic() - self.sampled >= self.interval:
+                    self.adjust(self.sample())
+                if self.active < self.allowed:
+                    break
+                self.condition.wait(self.interval)
+            self.active += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.enabled:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
+
+    def query(self, query):
+        logging.debug(f'SQL: {query}')
+        self.cursor.execute(query)
+        columns = [column[0] for column in self.cursor.description or []]
+        return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
+
+    def sample(self):
+        """Load of the server relative to the limits, 1 means at the limit; None when it can not be read."""
+        now = time.monotonic()
+        elapsed = now - self.sampled if self.sampled else None
+        self.sampled = now
+        try:
+            if not self.conn:
+                self.conn, self.cursor = self.connect()
+            status = {row['Variable_name']: int(row['Value']) for row in self.query(
+                "SHOW GLOBAL STATUS WHERE Variable_name IN ('Threads_running', 'Innodb_buffer_pool_reads')")}
+            # our own running exports and this query are not the load we back off from
+            values = {'threads_running': status.get('Threads_running', 0) - self.active - 1}
+            pool_reads = status.get('Innodb_buffer_pool_reads', 0)
+            if elapsed and self.pool_reads is not None:
+                values['pool_reads'] = (pool_reads - self.pool_reads) / elapsed
+            self.pool_reads = pool_reads
+            if self.limits['replica_lag']:
+                values['replica_lag'] = self.replica_lag()
+        except mysql.connector.Error as error:
+            logging.warning(f'Can not read the load of the server, throttling is skipped: {error}')
+            self.close()
+            return None
+        ratio = max(values.get(name, 0) / limit for name, limit in self.limits.items() if limit)
+        logging.debug(f'Server load: {values}, {ratio:.2f} of the limits')
+        return ratio
+
+    def replica_lag(self):
+        try:
+            rows = self.query("SHOW REPLICA STATUS")
+        except mysql.connector.Error as error:
+            if error.errno != errorcode.ER_PARSE_ERROR:
+                raise
+            rows = self.query("SHOW SLAVE STATUS")
+        lags = [row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master')) for row in rows]
+        return max((lag for lag in lags if lag is not None), default=0)
+
+    def adjust(self, ratio):
+        if ratio is None:
+            return
+        allowed = self.allowed
+        if ratio <= 1:
+            allowed = min(self.allowed + 1, self.jobs)
+        elif ratio <= 2:
+            allowed = max(self.allowed // 2, 1)
+        else:
+            allowed = 0
+        if allowed != self.allowed:
+            if allowed:
+                logging.info(f'Server load is {ratio:.2f} of the limits, exporting with {allowed} of {self.jobs} workers')
+            else:
+                logging.info(f'Server load is {ratio:.2f} of the limits, exports are paused')
+            self.allowed = allowed
+            self.condition.notify_all()
+
+    def close(self):
+        if self.conn:
+            try:
+                self.cursor.close()
+                self.conn.close()
+            except Exception as e:
+                logging.warning(f'Error closing MySQL throttle connection: {e}')
+        self.conn = self.cursor = None
+
+
+class FairSlots:
+    """Limits how many databases the instances of a run export at once, the slots are handed out in the order asked.
+
+    An instance asks again for every database, so the instances take turns instead of one keeping a slot to its last database.
+    `count` None is no limit.
+    """
+
+    def __init__(self, count=None):
+        self.free = count
+        self.waiting = deque()
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        if self.free is None:
+            return self
+        with self.lock:
+            if self.free and not self.waiting:
+                self.free -= 1
+                return self
+            ready = threading.Event()
+            self.waiting.append(ready)
+        ready.wait()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.free is None:
+            return
+        with self.lock:
+            if self.waiting:
+                # the slot goes straight to the instance waiting longest
+                self.waiting.popleft().set()
+            else:
+                self.free += 1
+
+
+class DiskGuard:
+    """Holds back the next export while a filesystem of the backup has less than `min_free` bytes free.
+
+    The exports running go on, the others wait until space is freed, e.g. by the compressor of the pipeline,
+    and the backup fails after `timeout` seconds of waiting.
+    """
+
+    def __init__(self, paths, min_free, timeout=600, interval=5):
+        self.paths = list(dict.fromkeys(Path(path) for path in paths))
+        self.min_free = min_free
+        self.timeout = timeout
+        self.interval = interval
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def existing(path):
+        """The path or its nearest parent which exists, the folders of the backup may not be created yet."""
+        path = Path(path).absolute()
+        while not path.exists() and path != path.parent:
+            path = path.parent
+        return path
+
+    @classmethod
+    def free(cls, path):
+        return shutil.disk_usage(cls.existing(path)).free
+
+    @classmethod
+    def same_device(cls, path, other):
+        return cls.existing(path).stat().st_dev == cls.existing(other).stat().st_dev
+
+    def short(self):
+        return [f"{path} {free / 1024 ** 2:.1f} MB free" for path in self.paths if (free := self.free(path)) < self.min_free]
+
+    def __enter__(self):
+        if not self.min_free:
+            return self
+        # one export waits for the space, the others wait for it
+        with self.lock:
+            short = self.short()
+            if not short:
+                return self
+            logging.warning(f"Exports paused, less than {self.min_free / 1024 ** 2:.1f} MB left: {', '.join(short)}")
+            deadline = time.monotonic() + self.timeout
+            while short:
+                if time.monotonic() > deadline:
+                    die(f"No space freed in {self.timeout:.0f}s: {', '.join(short)}")
+                time.sleep(self.interval)
+                short = self.short()
+            logging.info('Exports resumed')
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class Metrics:
+    """Durations, bytes and rows of the run per phase, database and table, saved as JSON and Prometheus textfile."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.phases = {}
+        self.databases = {}
+        self.lock = threading.Lock()
+
+    def database(self, db_name):
+        return self.databases.setdefault(db_name, {'phases': {}, 'bytes': 0, 'rows': 0, 'archive_bytes': 0, 'tables': {}})
+
+    def add_phase(self, db_name, phase, seconds):
+        """Adds the duration of the phase, `db_name` None is a phase of the whole run."""
+        with self.lock:
+            phases = self.database(db_name)['phases'] if db_name else self.phases
+            phases[phase] = phases.get(phase, 0) + seconds
+
+    def add_table(self, db_name, table_name, seconds, size, rows):
+        with self.lock:
+            database = self.database(db_name)
+            table = database['tables'].setdefault(table_name, {'seconds': 0, 'bytes': 0, 'rows': 0})
+            table['seconds'] += seconds
+            table['bytes'] += size
+            table['rows'] += rows
+            database['bytes'] += size
+            database['rows'] += rows
+
+    def set_archive_size(self, db_name, size):
+        with self.lock:
+            self.database(db_name)['archive_bytes'] = size
+
+    def report(self, success):
+        with self.lock:
+            return {
+                'started': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'duration': round(time.time() - self.started, 3),
+                'success': success,
+                'phases': dict(self.phases),
+                'databases': copy.deepcopy(self.databases),
+            }
+
+    @staticmethod
+    def save(path, content):
+        temp_path = Path(f'{path}.tmp')
+        with open(temp_path, 'w') as file:
+            file.write(content)
+        os.replace(temp_path, path)
+
+    def save_json(self, path, success):
+        self.save(path, json.dumps(self.report(success), indent=2, sort_keys=True))
+
+    @staticmethod
+    def labels(**labels):
+        values = {name: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for name, value in labels.items()}
+        return '{' + ','.join(f'{name}="{value}"' for name, value in values.items()) + '}'
+
+    def save_textfile(self, path, success):
+        """Metrics in the Prometheus text format, for the textfile collector of node exporter."""
+        self.write_textfile(path, [self.samples(success)])
+
+    def samples(self, success, **labels):
+        """Metrics of the run as name: (type, description, [(labels, value)]), `labels` are added to every sample."""
+        report = self.report(success)
+        run_labels = self.labels(**labels) if labels else ''
+        metrics = {
+            'mysql_backup_last_run_timestamp_seconds': ('gauge', 'Start of the last backup run.', [(run_labels, self.started)]),
+            'mysql_backup_last_run_success': ('gauge', '1 when the last backup run finished without error.', [(run_labels, int(success))]),
+            'mysql_backup_last_run_duration_seconds': ('gauge', 'Duration of the last backup run.', [(run_labels, report['duration'])]),
+            'mysql_backup_phase_duration_seconds': ('gauge', 'Duration of the phase of the last run.', []),
+            'mysql_backup_database_bytes': ('gauge', 'Bytes of the data files exported for the database.', []),
+            'mysql_backup_database_rows': ('gauge', 'Rows exported for the database.', []),
+            'mysql_backup_archive_bytes': ('gauge', 'Size of the archive of the database.', []),
+            'mysql_backup_table_duration_seconds': ('gauge', 'Time spent exporting the table.', []),
+            'mysql_backup_table_bytes': ('gauge', 'Bytes of the data files exported for the table.', []),
+            'mysql_backup_table_rows': ('gauge', 'Rows exported for the table.', []),
+        }
+        for phase, seconds in report['phases'].items():
+            metrics['mysql_backup_phase_duration_seconds'][2].append((self.labels(**labels, database='', phase=phase), seconds))
+        for db_name, database in report['databases'].items():
+            for phase, seconds in database['phases'].items():
+                metrics['mysql_backup_phase_duration_seconds'][2].append((self.labels(**labels, database=db_name, phase=phase), seconds))
+            metrics['mysql_backup_database_bytes'][2].append((self.labels(**labels, database=db_name), database['bytes']))
+            metrics['mysql_backup_database_rows'][2].append((self.labels(**labels, database=db_name), database['rows']))
+            metrics['mysql_backup_archive_bytes'][2].append((self.labels(**labels, database=db_name), database['archive_bytes']))
+            for table_name, table in database['tables'].items():
+                table_labels = self.labels(**labels, database=db_name, table=table_name)
+                metrics['mysql_backup_table_duration_seconds'][2].append((table_labels, table['seconds']))
+                metrics['mysql_backup_table_bytes'][2].append((table_labels, table['bytes']))
+                metrics['mysql_backup_table_rows'][2].append((table_labels, table['rows']))
+        return metrics
+
+    @classmethod
+    def write_textfile(cls, path, runs):
+        """Saves the samples of one or several runs, every metric is described once."""
+        lines = []
+        for name, (metric_type, description, _) in runs[0].items():
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}']
+            lines += [f'{name}{labels} {value}' for metrics in runs for labels, value in metrics[name][2]]
+        cls.save(path, '\n'.join(lines) + '\n')
+
+
+class Progress:
+    """Bytes exported for a database, sizes of the files being written are polled while the export runs."""
+
+    def __init__(self, db_name, total, prefix=None, interval=30):
+        self.db_name = db_name
+        self.total = total
+        self.prefix = prefix
+        self.interval = interval
+        self.done = 0
+        self.running = {}
+        self.last_message = ''
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self, path):
+        with self.lock:
+            self.running[str(path)] = 0
+
+    def track(self, path, blocks):
+        """Counts blocks written to the file which is not staged, e.g. the rows compressed on the fly."""
+        for block in blocks:
+            with self.lock:
+                self.running[str(path)] += len(block)
+            yield block
+
+    @staticmethod
+    def file_size(path, counted):
+        try:
+            return max(counted, os.path.getsize(path))
+        except OSError:
+            return counted
+
+    def finish(self, path):
+        with self.lock:
+            size = self.file_size(path, self.running.pop(str(path), 0))
+            self.done += size
+        return size
+
+    def written(self):
+        with self.lock:
+            running = list(self.running.items())
+            done = self.done
+        return done + sum(self.file_size(path, counted) for path, counted in running)
+
+    def throughput(self):
+        written_mb = self.written() / 1024 ** 2
+        return f"{written_mb:.1f} MB, {written_mb / max(time.time() - self.start_time, 0.001):.1f} MB/s"
+
+    def message(self):
+        written = self.written()
+        duration = max(time.time() - self.start_time, 0.001)
+        rate = written / duration
+        eta = '?'
+        if rate and self.total > written:
+            seconds = int((self.total - written) / rate)
+            eta = f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+        elif self.total <= written:
+            eta = '0:00:00'
+        return (f"{written / 1024 ** 2:.1f} of ~{self.total / 1024 ** 2:.1f} MB, "
+                f"{rate / 1024 ** 2:.1f} MB/s, ETA {eta}")
+
+    def report(self):
+        message = self.message()
+        if self.prefix is not None:
+            print(f"\r{self.prefix}{message.ljust(len(self.last_message))}", end='', flush=True)
+        else:
+            logging.info(f"Exporting '{self.db_name}': {message}")
+        self.last_message = message
+
+    def report_worker(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def start_reporting(self):
+        self.thread = threading.Thread(target=self.report_worker, name='progress', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        if self.prefix is not None and self.last_message:
+            # the dotted line is finished by the caller
+            print(f"\r{self.prefix}{' ' * len(self.last_message)}\r{self.prefix}", end='', flush=True)
+
+
+COMPRESSORS = {
+    'gzip': Compressor,
+    'pgzip': ParallelGzipCompressor,
+    'zstd': ZstdCompressor,
+    'none': NoCompressor,
+}
+
+
+def compressor_for(file_name):
+    """Compressor of the archive or the data file, recognized by the extension of its name."""
+    for compressor in COMPRESSORS.values():
+        extensions = [compressor.extension] + ([compressor.file_extension] if compressor.file_extension else [])
+        if any(str(file_name).endswith(f'.{extension}') for extension in extensions):
+            return compressor()
+    return NoCompressor()
+
+
 class Backup:
     ignore_databases = ['information_schema', 'performance_schema', 'sys', 'mysql']
     inline_sql = "FIELDS TERMINATED BY ';' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\n'"
@@ -42,13 +1401,63 @@ class Backup:
     sql_retry_attempts = SQL_RETRY_ATTEMPTS
     weekday_limit = 10
     sunday_limit = 4
+    jobs = 1
+    chunk_rows = None
+    chunk_size = None
+    max_staged = 2
+    compression = 'gzip'
+    compress_level = None
+    compress_threads = None
     mysql_config_file = Path("~/.my.cnf").expanduser()
     SecureFilePriv = Path(SecureFilePriv)
+    pipeline = False
     conn = None
     cursor = None
+    metadata = None
+    compress_queue = None
+    stream = False
+    stream_archive = None
+    incremental = False
+    data_directory = None
+    dedup = False
+    dedup_store = None
+    checksums = None
+    table_checksums = False
+    resume = False
+    resume_max_age = 24
+    checkpoint = None
+    index_algorithm = None
+    client_export = False
+    client_batch_rows = 10000
+    progress = None
+    progress_interval = 30
+    throttle = None
+    max_threads_running = None
+    max_replica_lag = None
+    max_pool_reads = None
+    throttle_interval = 5
+    compress_rate = None
+    metrics_file = None
+    indexed = False
+    metrics_textfile = None
+    parallel_instances = 2
+    min_free = 1024 ** 3
+    disk_wait = 600
+    disk_guard = None
 
     def __init__(self, **kwargs):
         self.config_file_path = Path(kwargs.get('config') or self.mysql_config_file)
+        self.instance = kwargs.get('instance')
+        # settings of [backup] shared by the instances, the connection is configured by each instance
+        self.shared = kwargs.get('shared')
+        # every instance of a run gets its own settings
+        self.db_config = dict(self.db_config)
+        self.ignore_databases = list(self.ignore_databases)
+        self.metadata = {}
+        self.metrics = Metrics()
+        self.slots = FairSlots()
+        # databases the capacity plan moves to the archive as they are exported
+        self.stream_databases = set()
         self.read_config_file()
         self.rocksdb = kwargs.get('rocksdb')
         self.debug = kwargs.get('debug')
@@ -57,15 +1466,77 @@ class Backup:
         self.oft = kwargs.get('oft')
         self.fast = kwargs.get('fast')
         self.separate_index = not kwargs.get('nli')
+        self.index_algorithm = 'INPLACE' if kwargs.get('inplace') else self.index_algorithm
         self.dry_run = kwargs.get('dry_run')
         self.exclude = self.set_regexp(kwargs.get('exclude'), 'exclude')
         self.include = self.set_regexp(kwargs.get('include'), 'include')
         self.log = kwargs.get('log')
+        self.jobs = kwargs.get('jobs') or self.jobs
+        if self.jobs < 1:
+            die("--jobs must be a positive number")
+        self.chunk_rows = kwargs.get('chunk_rows') or self.chunk_rows
+        self.chunk_size = kwargs.get('chunk_size') or self.chunk_size
+        self.pipeline = kwargs.get('pipeline') or self.pipeline
+        self.max_staged = kwargs.get('max_staged') or self.max_staged
+        if self.max_staged < 1:
+            die("--max-staged must be a positive number")
+        self.stream = kwargs.get('stream') or self.stream
+        self.incremental = kwargs.get('incremental') or self.incremental
+        self.dedup = kwargs.get('dedup') or self.dedup
+        self.table_checksums = kwargs.get('table_checksums') or self.table_checksums
+        if self.dedup and self.incremental:
+            logging.info('Ignoring `incremental` argument as the dedup store keeps only the changed chunks')
+            self.incremental = False
+        if self.incremental and self.stream:
+            logging.info('Ignoring `stream` argument as incremental backups compress every data file separately')
+            self.stream = False
+        if self.dedup and self.stream:
+            logging.info('Ignoring `stream` argument as data files are moved to the dedup store')
+            self.stream = False
+        if self.stream and self.pipeline:
+            logging.info('Ignoring `pipeline` argument as data files are compressed during export')
+            self.pipeline = False
+        self.client_export = kwargs.get('client_export') or self.client_export
+        self.indexed = kwargs.get('indexed') or self.indexed
+        self.resume = kwargs.get('resume') or self.resume
+        if self.resume and self.stream:
+            logging.info('Ignoring `resume` argument as exported files are moved to the archive in stream mode')
+            self.resume = False
+        if self.resume and self.dedup:
+            logging.info('Ignoring `resume` argument as the chunk list is saved when the whole database is exported')
+            self.resume = False
+        self.compression = kwargs.get('compression') or self.compression
+        if self.compression not in COMPRESSORS:
+            die(f"Unknown compressor '{self.compression}', use one of: {', '.join(COMPRESSORS)}")
+        self.compressor = COMPRESSORS[self.compression](
+            kwargs.get('compress_level') or self.compress_level,
+            kwargs.get('compress_threads') or self.compress_threads,
+            self.nice,
+            kwargs.get('compress_rate') or self.compress_rate,
+        )
+        self.throttle = Throttle(
+            self.connect_worker, self.jobs,
+            kwargs.get('max_threads_running') or self.max_threads_running,
+            kwargs.get('max_replica_lag') or self.max_replica_lag,
+            self.max_pool_reads,
+            self.throttle_interval,
+        )
         self.engine = self.change_engine(kwargs.get('engine'))
+        self.metrics_file = kwargs.get('metrics') or self.metrics_file
+        self.metrics_textfile = kwargs.get('metrics_textfile') or self.metrics_textfile
+        self.parallel_instances = kwargs.get('parallel_instances') or self.parallel_instances
+        if self.parallel_instances < 1:
+            die("--parallel-instances must be a positive number")
         self.output = self.test_directory(kwargs.get('output'))
         self.path = '' if self.output else self.test_directory(kwargs.get('save'))
+        if self.incremental and (self.output or self.path):
+            die("--incremental keeps backups in day folders of backup_dir, it can not be combined with --output or --save")
+        if self.dedup and (self.output or self.path):
+            die("--dedup keeps chunks in backup_dir shared by its day folders, it can not be combined with --output or --save")
+        self.min_free = kwargs.get('min_free') if kwargs.get('min_free') is not None else self.min_free
+        self.disk_guard = DiskGuard((self.SecureFilePriv, self.target_folder()), self.min_free, self.disk_wait)
         logging.debug(self.connection_settings())
-        if not self.db_config:
+        if not self.db_config and not self.shared:
             die("MySQL configuration not found")
 
     @staticmethod
@@ -91,6 +1562,11 @@ class Backup:
 
     def __enter__(self):
         self.connect_to_database()
+        if self.client_export:
+            # the rows come over the connection, secure_file_priv is just a local staging folder
+            if not self.SecureFilePriv.is_dir():
+                die(f"Folder {self.SecureFilePriv} does not exist.")
+            return self
         self.sql("SHOW VARIABLES like 'secure_file_priv'")
         mysql_secure_file_priv = self.cursor.fetchone()[1]
         if not mysql_secure_file_priv:
@@ -102,15 +1578,43 @@ class Backup:
     def connect_to_database(self):
         self.conn = mysql.connector.connect(**self.db_config)
         self.cursor = self.conn.cursor()
-        self.sql("SET SESSION wait_timeout = 28800")
-        self.sql("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        self.configure_session()
+
+    def configure_session(self, cursor=None):
+        self.sql("SET SESSION wait_timeout = 28800", cursor)
+        self.sql("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ", cursor)
+        if self.client_export:
+            # rows are sent in the charset of the columns, as SELECT ... INTO OUTFILE writes them
+            self.sql("SET SESSION character_set_results = NULL", cursor)
+        if self.incremental:
+            self.fresh_statistics(cursor)
+
+    def fresh_statistics(self, cursor=None):
+        """MySQL 8.0 caches UPDATE_TIME and TABLE_ROWS of information_schema for `information_schema_stats_expiry` seconds.
+
+        A cached value could make a changed table look unchanged, so the fingerprints are read without the cache.
+        Servers without the variable (5.7, MariaDB) read the statistics from the engine every time.
+        """
+        try:
+            self.sql("SET SESSION information_schema_stats_expiry = 0", cursor)
+        except mysql.connector.Error as error:
+            if error.errno != errorcode.ER_UNKNOWN_SYSTEM_VARIABLE:
+                die(f"--incremental needs fresh statistics of information_schema, "
+                    f"can not set information_schema_stats_expiry = 0: {error}")
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.throttle:
+            self.throttle.close()
         if self.cursor:
             self.cursor.close()
         if self.conn:
             self.conn.close()
 
+    @property
+    def interactive(self):
+        # dotted progress lines are only readable when one database is handled at a time
+        return not self.log and not self.debug and not self.pipeline and not self.instance
+
     def print(self, **kwargs):
         if not self.log:
             print(**kwargs)
@@ -124,9 +1628,9 @@ class Backup:
             logging.critical(traceback.format_exc())
             die(f"Error running command '{command}': {e}")
 
-    def sql(self, query):
+    def sql(self, query, cursor=None):
         logging.debug(f'SQL: {query}')
-        self.cursor.execute(query)
+        (cursor or self.cursor).execute(query)
 
     def reconnect(self, attempt=0):
         if self.conn:
@@ -137,6 +1641,7 @@ class Backup:
         try:
             self.conn = mysql.connector.connect(**self.db_config)
             self.cursor = self.conn.cursor()
+            self.configure_session()
         except mysql.connector.Error as error:
             if error.errno in retry_errors and attempt < self.sql_retry_attempts:
                 logging.warning(f'MySQL server error: {error}, attempting to reconnect: attempt {attempt + 1}')
@@ -151,8 +1656,22 @@ class Backup:
             logging.debug(f'Reading config file {self.config_file_path}')
             config = configparser.ConfigParser()
             config.read(self.config_file_path)
-            if 'client' in config:
-                client = config['client']
+            client = dict(config['client']) if 'client' in config else {}
+            backup = dict(config['backup']) if 'backup' in config else {}
+            if self.instance:
+                section = f'instance:{self.instance}'
+                if section not in config:
+                    die(f"Instance {self.instance} is not in {self.config_file_path}")
+                if any(key in config[section] for key in ('socket', 'host', 'port')):
+                    # the instance is reached its own way, not through the socket or host of [client]
+                    for key in ('socket', 'host', 'port'):
+                        client.pop(key, None)
+                for key, value in config[section].items():
+                    if key in CLIENT_KEYS:
+                        client[key] = value
+                    else:
+                        backup[key] = value
+            if client:
                 if 'user' in client:
                     self.db_config['user'] = client['user']
                 if 'password' in client:
@@ -163,8 +1682,7 @@ class Backup:
                     self.db_config['host'] = client['host']
                 elif 'port' in client:
                     self.db_config['port'] = client['port']
-            if 'backup' in config:
-                backup = config['backup']
+            if backup:
                 if 'ignore' in backup:
                     self.ignore_databases += re.split(r'[,;\s]+', backup['ignore'])
                 if 'nice' in backup:
@@ -177,10 +1695,68 @@ class Backup:
                     self.backup_dir = Path(backup['path'])
                 if 'secure_file_priv' in backup:
                     self.SecureFilePriv = Path(backup['secure_file_priv'])
+                if 'jobs' in backup:
+                    self.jobs = int(backup['jobs'])
+                if 'chunk_rows' in backup:
+                    self.chunk_rows = int(backup['chunk_rows'])
+                if 'chunk_size' in backup:
+                    self.chunk_size = parse_size(backup['chunk_size'])
+                if 'pipeline' in backup:
+                    self.pipeline = backup['pipeline'].upper() in ('YES', 'ON')
+                if 'max_staged' in backup:
+                    self.max_staged = int(backup['max_staged'])
+                if 'stream' in backup:
+                    self.stream = backup['stream'].upper() in ('YES', 'ON')
+                if 'incremental' in backup:
+                    self.incremental = backup['incremental'].upper() in ('YES', 'ON')
+                if 'table_checksums' in backup:
+                    self.table_checksums = backup['table_checksums'].upper() in ('YES', 'ON')
+                if 'dedup' in backup:
+                    self.dedup = backup['dedup'].upper() in ('YES', 'ON')
+                if 'client_export' in backup:
+                    self.client_export = backup['client_export'].upper() in ('YES', 'ON')
+                if 'client_batch_rows' in backup:
+                    self.client_batch_rows = int(backup['client_batch_rows'])
+                if 'progress_interval' in backup:
+                    self.progress_interval = float(backup['progress_interval'])
+                if 'max_threads_running' in backup:
+                    self.max_threads_running = int(backup['max_threads_running'])
+                if 'max_replica_lag' in backup:
+                    self.max_replica_lag = int(backup['max_replica_lag'])
+                if 'max_pool_reads' in backup:
+                    self.max_pool_reads = int(backup['max_pool_reads'])
+                if 'throttle_interval' in backup:
+                    self.throttle_interval = float(backup['throttle_interval'])
+                if 'compress_rate' in backup:
+                    self.compress_rate = parse_size(backup['compress_rate'])
+                if 'indexed' in backup:
+                    self.indexed = backup['indexed'].upper() in ('YES', 'ON')
+                if 'metrics' in backup:
+                    self.metrics_file = backup['metrics']
+                if 'metrics_textfile' in backup:
+                    self.metrics_textfile = backup['metrics_textfile']
+                if 'parallel_instances' in backup:
+                    self.parallel_instances = int(backup['parallel_instances'])
+                if 'min_free' in backup:
+                    self.min_free = parse_size(backup['min_free'])
+                if 'disk_wait' in backup:
+                    self.disk_wait = float(backup['disk_wait'])
+                if 'resume' in backup:
+                    self.resume = backup['resume'].upper() in ('YES', 'ON')
+                if 'resume_max_age' in backup:
+                    self.resume_max_age = float(backup['resume_max_age'])
+                if 'compressor' in backup:
+                    self.compression = backup['compressor']
+                if 'compress_level' in backup:
+                    self.compress_level = int(backup['compress_level'])
+                if 'compress_threads' in backup:
+                    self.compress_threads = int(backup['compress_threads'])
                 if 'sql_retry_attempts' in backup:
                     self.sql_retry_attempts = int(backup['sql_retry_attempts'])
                 if 'fast' in backup:
                     self.fast = not backup['fast'].upper() in ('YES', 'ON')
+                if 'inplace' in backup:
+                    self.index_algorithm = 'INPLACE' if backup['inplace'].upper() in ('YES', 'ON') else None
                 if 'nli' in backup:
                     self.separate_index = not backup['nli'].upper() in ('YES', 'ON')
                 if 'oft' in backup:
@@ -208,11 +1784,77 @@ class Backup:
         exclude_patterns = [f"^{pattern.replace('*', '.*')}$" if '*' in pattern else f"^{pattern}$" for pattern in exclude_dbs]
         return [db[0] for db in self.cursor.fetchall() if not any(re.match(pattern, db[0]) for pattern in exclude_patterns)]
 
+    def load_metadata(self, databases):
+        """Loads tables, engines, sizes, partitions and primary keys of the databases with three queries.
+
+        The result is cached for the run instead of asking the server about every database and table.
+        """
+        databases = [db_name for db_name in databases if db_name not in self.metadata]
+        if not databases:
+            return
+        for db_name in databases:
+            self.metadata[db_name] = {}
+        schemas = ', '.join(f"'{db_name}'" for db_name in databases)
+        self.sql("SELECT TABLE_SCHEMA, TABLE_NAME, ENGINE, TABLE_ROWS, AVG_ROW_LENGTH, DATA_LENGTH, INDEX_LENGTH, "
+                 f"UPDATE_TIME, CREATE_OPTIONS FROM information_schema.TABLES WHERE TABLE_SCHEMA IN ({schemas}) "
+                 "ORDER BY TABLE_SCHEMA, TABLE_NAME")
+        for db_name, table_name, engine, rows, avg_row_length, data_length, index_length, update_time, create_options \
+                in self.cursor.fetchall():
+            self.metadata[db_name][table_name] = {
+                'engine': engine,
+                'rows': rows or 0,
+                'avg_row_length': avg_row_length or 0,
+                'data_length': data_length or 0,
+                'index_length': index_length or 0,
+                'update_time': update_time,
+                'create_options': create_options or '',
+                'partitions': [],
+                'primary_key': [],
+            }
+        self.sql("SELECT TABLE_SCHEMA, TABLE_NAME, PARTITION_NAME, TABLE_ROWS, DATA_LENGTH, UPDATE_TIME "
+                 f"FROM information_schema.PARTITIONS WHERE TABLE_SCHEMA IN ({schemas}) AND PARTITION_NAME IS NOT NULL "
+                 "ORDER BY TABLE_SCHEMA, TABLE_NAME, PARTITION_ORDINAL_POSITION, SUBPARTITION_ORDINAL_POSITION")
+        for db_name, table_name, partition_name, rows, data_length, update_time in self.cursor.fetchall():
+            table = self.metadata[db_name].get(table_name)
+            if table is not None:
+                table['partitions'].append({
+                    'name': partition_name, 'rows': rows or 0, 'data_length': data_length or 0, 'update_time': update_time,
+                })
+        self.sql("SELECT k.TABLE_SCHEMA, k.TABLE_NAME, k.COLUMN_NAME, c.DATA_TYPE FROM information_schema.KEY_COLUMN_USAGE k "
+                 "JOIN information_schema.COLUMNS c ON c.TABLE_SCHEMA = k.TABLE_SCHEMA AND c.TABLE_NAME = k.TABLE_NAME "
+                 f"AND c.COLUMN_NAME = k.COLUMN_NAME WHERE k.TABLE_SCHEMA IN ({schemas}) AND k.CONSTRAINT_NAME = 'PRIMARY' "
+                 "ORDER BY k.TABLE_SCHEMA, k.TABLE_NAME, k.ORDINAL_POSITION")
+        for db_name, table_name, column_name, data_type in self.cursor.fetchall():
+            table = self.metadata[db_name].get(table_name)
+            if table is not None:
+                table['primary_key'].append((column_name, data_type.lower()))
+
+    def db_metadata(self, db_name):
+        self.load_metadata([db_name])
+        return self.metadata[db_name]
+
     def has_rocksdb_tables(self, db_name):
-        self.sql(f"SELECT count(*) FROM information_schema.tables WHERE table_schema = '{db_name}' and `engine` = 'ROCKSDB'")
-        return self.cursor.fetchone()[0] > 0
+        return any((table['engine'] or '').upper() == 'ROCKSDB' for table in self.db_metadata(db_name).values())
 
     def process(self):
+        success = False
+        try:
+            self.process_databases()
+            success = True
+        finally:
+            if not self.dry_run:
+                self.save_metrics(success)
+
+    def save_metrics(self, success):
+        for path, save in ((self.metrics_file, self.metrics.save_json), (self.metrics_textfile, self.metrics.save_textfile)):
+            if path:
+                try:
+                    save(path, success)
+                except OSError as e:
+                    logging.warning(f"Can not save metrics to {path}: {e}")
+
+    def process_databases(self):
+        start_time = time.time()
         if self.db_names:
             all_database = self.get_databases(exclude_dbs=self.ignore_databases)
             databases = self.db_names.split(',')
@@ -221,17 +1863,191 @@ class Backup:
                 die(f"Databases absent on database server: {','.join(missing_dbs)}")
         else:
             databases = self.get_databases(self.ignore_databases)
-        for db_name in databases:
-            table_names = self.get_tables(db_name)
-            if not table_names:
-                continue
-            self.process_db(db_name)
+        self.load_metadata(databases)
+        self.metrics.add_phase(None, 'metadata', time.time() - start_time)
+        # the largest database goes first, so the smaller ones fill the time it is compressed in the pipeline
+        databases.sort(key=lambda db_name: sum(table['data_length'] for table in self.db_metadata(db_name).values()), reverse=True)
+        self.plan_capacity(databases)
+        if self.pipeline and not self.dry_run:
+            self.start_pipeline()
+        try:
+            for db_name in databases:
+                table_names = self.get_tables(db_name)
+                if not table_names:
+                    continue
+                if self.compress_queue:
+                    self.wait_staging_slot()
+                with self.slots:
+                    self.process_db(db_name)
+        finally:
+            if self.compress_queue:
+                self.stop_pipeline()
         if not self.output and not self.dry_run:
+            start_time = time.time()
             self.clean_old_backups()
+            self.metrics.add_phase(None, 'cleanup', time.time() - start_time)
+
+    def estimate_database(self, db_name):
+        """Estimated data size, archive size, number of data files and the largest data file of the database backup.
+
+        The data size is DATA_LENGTH of the tables or the size of the data files of the previous incremental backup
+        when it is larger. The archive size is the size of the previous backup or, for the first one, the data size
+        times the usual ratio of the compressor.
+        """
+        tables = [table for table_name, table in self.db_metadata(db_name).items() if self.table_match(table_name)]
+        raw = sum(table['data_length'] for table in tables)
+        files = largest = 0
+        for table in tables:
+            if table['partitions']:
+                sizes = {}
+                for partition in table['partitions']:
+                    sizes[partition['name']] = sizes.get(partition['name'], 0) + partition['data_length']
+                files += len(sizes)
+                largest = max(largest, *sizes.values())
+                continue
+            size = table['data_length']
+            if len(table['primary_key']) == 1 and table['primary_key'][0][1] in INTEGER_TYPES:
+                if self.chunk_size:
+                    size = min(size, self.chunk_size)
+                if self.chunk_rows and table['avg_row_length']:
+                    size = min(size, self.chunk_rows * table['avg_row_length'])
+            files += -(-table['data_length'] // size) if size else 1
+            largest = max(largest, size)
+        archives = [path for path in Path(self.backup_dir).glob(f'*/{db_name}.{self.compressor.extension}') if path.is_file()]
+        previous = max(archives, key=os.path.getmtime).stat().st_size if archives else None
+        manifest = Manifest.latest(self.backup_dir, db_name, None) if self.incremental else None
+        if previous is not None and manifest:
+            data_files = [manifest.stored_path(file['file']) for table in manifest.tables.values() for file in table['files']]
+            previous += sum(path.stat().st_size for path in data_files if path.is_file())
+            raw = max(raw, sum(file.get('size', 0) for table in manifest.tables.values() for file in table['files']))
+        compressed = previous if previous is not None and not self.dedup else int(raw * self.compressor.ratio)
+        return {'raw': raw, 'compressed': compressed, 'files': max(files, 1), 'largest': largest, 'previous': previous is not None}
+
+    def plan_capacity(self, databases):
+        """Compares the estimated sizes of the databases with free space of `secure_file_priv` and the backup folder.
+
+        Exported data waits in `secure_file_priv` until its database is compressed, so the pipeline is given fewer
+        databases to stage, and a database which does not fit is moved to its archive file by file as with `--stream`.
+        The backup is refused when the space left would still be less than `min_free`; shown by `--dry-run`.
+        """
+        databases = [db_name for db_name in databases if self.get_tables(db_name)]
+        if not databases:
+            return
+        estimates = {db_name: self.estimate_database(db_name) for db_name in databases}
+        target = self.target_folder()
+        staging_free = DiskGuard.free(self.SecureFilePriv)
+        backup_free = DiskGuard.free(target)
+        archived = sum(estimate['compressed'] for estimate in estimates.values())
+        # unchanged tables or chunks are linked, the estimate is the most the backup can take
+        upper_bound = self.incremental or self.dedup
+        staging_room = staging_free - self.min_free
+        if DiskGuard.same_device(self.SecureFilePriv, target) and not upper_bound:
+            staging_room -= archived
+
+        def staged(db_name):
+            estimate = estimates[db_name]
+            if self.stream or upper_bound or db_name in self.stream_databases:
+                return min(self.jobs, estimate['files']) * estimate['largest']
+            return estimate['raw']
+
+        def staging_need():
+            sizes = sorted((staged(db_name) for db_name in databases), reverse=True)
+            return sum(sizes[:self.max_staged]) if self.pipeline else sizes[0]
+
+        changes = []
+        problems = []
+        if archived > backup_free - self.min_free:
+            message = f"backup needs ~{archived / 1024 ** 2:.1f} MB in {target}, {backup_free / 1024 ** 2:.1f} MB free"
+            if upper_bound:
+                logging.warning(f"Capacity: {message}, unchanged data is linked so it may still fit")
+            else:
+                problems.append(message)
+        while staging_need() > staging_room:
+            if self.pipeline and self.max_staged > 1:
+                self.max_staged -= 1
+                changes.append(f"max_staged lowered to {self.max_staged}")
+                continue
+            streamable = [] if self.stream or upper_bound or self.resume else [
+                db_name for db_name in databases if db_name not in self.stream_databases
+                and staged(db_name) > min(self.jobs, estimates[db_name]['files']) * estimates[db_name]['largest']
+            ]
+            if not streamable:
+                problems.append(f"staging needs ~{staging_need() / 1024 ** 2:.1f} MB in {self.SecureFilePriv}, "
+                                f"{staging_free / 1024 ** 2:.1f} MB free")
+                break
+            if self.pipeline:
+                # the stream archive is closed by the same thread which exports the database
+                self.pipeline = False
+                changes.append('pipeline turned off')
+            db_name = max(streamable, key=lambda name: estimates[name]['raw'])
+            self.stream_databases.add(db_name)
+            changes.append(f"'{db_name}' streamed to its archive")
+        summary = (f"Capacity plan: staging ~{staging_need() / 1024 ** 2:.1f} MB of {staging_free / 1024 ** 2:.1f} MB free "
+                   f"in {self.SecureFilePriv}, archives ~{archived / 1024 ** 2:.1f} MB of {backup_free / 1024 ** 2:.1f} MB free "
+                   f"in {target}, min_free {self.min_free / 1024 ** 2:.1f} MB")
+        if self.dry_run:
+            print(summary)
+            for db_name, estimate in estimates.items():
+                source = 'previous backup' if estimate['previous'] and not self.dedup else f"ratio {self.compressor.ratio}"
+                print(f"  {db_name}: data ~{estimate['raw'] / 1024 ** 2:.1f} MB, archive ~{estimate['compressed'] / 1024 ** 2:.1f} MB "
+                      f"({source}), staged ~{staged(db_name) / 1024 ** 2:.1f} MB")
+            for change in changes:
+                print(f"  {change}")
+            for problem in problems:
+                print(f"  Would refuse: {problem}")
+            return
+        logging.info(summary + ''.join(f", {change}" for change in changes))
+        if problems:
+            die(f"Not enough disk space, {'; '.join(problems)} and min_free is {self.min_free / 1024 ** 2:.1f} MB")
+
+    def start_pipeline(self):
+        """Starts the compression stage which runs while the next database is exported.
+
+        `max_staged` limits how many exported but not yet compressed databases may sit in `secure_file_priv`.
+        """
+        self.compress_queue = queue.Queue()
+        self.staging_slots = threading.BoundedSemaphore(self.max_staged)
+        self.pipeline_error = None
+        self.compress_thread = threading.Thread(target=self.compress_worker, name='compress', daemon=True)
+        self.compress_thread.start()
+
+    def wait_staging_slot(self):
+        self.staging_slots.acquire()
+        if self.pipeline_error:
+            self.staging_slots.release()
+            raise self.pipeline_error
+
+    def stop_pipeline(self):
+        self.compress_queue.put(None)
+        self.compress_thread.join()
+        self.compress_queue = None
+        if self.pipeline_error:
+            raise self.pipeline_error
+
+    def compress_worker(self):
+        while True:
+            job = self.compress_queue.get()
+            if job is None:
+                break
+            archive_name, db_name, sql_files, checksums = job
+            try:
+                if not self.pipeline_error:
+                    self.compress(archive_name, db_name, sql_files, checksums)
+                    self.cleanup_output_folder(db_name, sql_files=sql_files)
+            except BaseException as error:
+                self.pipeline_error = error
+            finally:
+                self.staging_slots.release()
+
+    def archive(self, archive_name, db_name, sql_files, checksums=None):
+        if self.compress_queue:
+            self.compress_queue.put((archive_name, db_name, sql_files, checksums))
+        else:
+            self.compress(archive_name, db_name, sql_files, checksums)
+            self.cleanup_output_folder(db_name, sql_files=sql_files)
 
     def get_tables(self, db_name):
-        self.sql(f"SHOW TABLES FROM `{db_name}`")
-        return [table[0] for table in self.cursor.fetchall()]
+        return list(self.db_metadata(db_name))
 
     def table_match(self, table_name):
         if self.include:
@@ -247,100 +2063,144 @@ class Backup:
             if rocksdb and not self.separate_index:
                 logging.info('Ignoring `nli` argument as exports for RocksDB')
                 self.separate_index = True
+            # a retry or a rerun after a crash keeps files of the finished exports
+            resume = self.resume and (attempt > 0 or self.checkpoint_path(db_name).is_file())
             if not self.dry_run:
-                if not self.log and not self.debug:
+                if self.interactive:
                     print(f"Backing up database: {db_name} ".ljust(60, '.'), flush=True, end='')
                 else:
                     logging.info(f"Backing up '{db_name}'")
-                self.cleanup_output_folder(db_name)
+                self.cleanup_output_folder(db_name, keep_data=resume)
             # backup database structure
-            tables_structures = {
-                table_name: self.get_table_structure(db_name, table_name, self.separate_index, rocksdb)
-                for table_name in self.get_db_tables(db_name) if self.table_match(table_name)
-            }
+            phase_start = time.time()
+            tables_structures = self.get_tables_structures(
+                db_name, [table_name for table_name in self.get_tables(db_name) if self.table_match(table_name)], rocksdb
+            )
+            self.metrics.add_phase(db_name, 'metadata', time.time() - phase_start)
             tables = tables_structures.keys()
             if self.dry_run:
                 print(f"Would be backed up: {db_name} : {','.join(tables)}")
                 return
-            self.sql("START TRANSACTION WITH CONSISTENT SNAPSHOT;")
-            import_sql = ''
-            index_sql = ''
-            load_data_sql = ''
-            files = [f"{db_name}.sql"]
-            total = len(tables)
-            for index, table_name in enumerate(tables):
-                if index == 0 or self.oft:
-                    import_sql = f'CREATE DATABASE IF NOT EXISTS `{db_name}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;\n'
-                    import_sql += f'USE `{db_name}`;\n'
-                    if rocksdb:
-                        import_sql += 'SET session sql_log_bin=0;\n'
-                        import_sql += 'SET session rocksdb_bulk_load=1;\n\n'
-                structure, indexes, primary_key = tables_structures[table_name]
-                if self.engine:
-                    structure = re.sub(r"ENGINE=\w+", f"ENGINE={self.engine}", structure)
-                charset_pattern = r"CHARSET=(\w+)(?:\s+COLLATE=\w+)?"
-                match = re.search(charset_pattern, structure)
-                charset = ('CHARACTER SET %s' % match.group(1)) if match else ''
-                import_sql += f' {table_name} '.center(60, '#') + '\n'
-                import_sql += f'DROP TABLE IF EXISTS `{table_name}`;\n'
-                import_sql += f'{structure};\n'
-                self.export_table_data(db_name, table_name, primary_key)
-                ext = 'csv' if self.as_csv else 'data'
-                csv_sql = self.inline_sql if self.as_csv else ''
-                sql = f'{charset} {csv_sql}'
-                table_file = self.SecureFilePriv / db_name / f'{table_name}.{ext}'
-                load_sql = f"LOAD DATA INFILE '{table_file}' INTO TABLE `{table_name}` {sql};"
-                if self.fast:
-                    load_data_sql += f"{load_sql}\n"
+            archive_name = self.archive_path(db_name)
+            self.checksums = Checksums()
+            if self.stream or db_name in self.stream_databases:
+                self.stream_archive = self.open_archive(archive_name, self.checksums)
+            manifest = previous = None
+            reused = {}
+            partitions = {}
+            partial = set()
+            if self.incremental:
+                self.prepare_backup_dir(archive_name.parent)
+                previous = Manifest.latest(self.backup_dir, db_name, archive_name.parent)
+                manifest = Manifest(db_name, archive_name.parent, self.compressor.file_extension)
+                fingerprints = self.table_fingerprints(db_name, tables_structures, cached=True)
+                partitions = self.partition_fingerprints(db_name, cached=True)
+                self.data_directory = DataDirectory(archive_name.parent, self.compressor, self.checksums)
+                if not resume:
+                    self.data_directory.clear(db_name)
+            if self.dedup:
+                self.prepare_backup_dir(archive_name.parent)
+                level = None if self.compression == 'none' else min(self.compressor.level, 9)
+                self.dedup_store = DedupStore(self.backup_dir / 'chunks', db_name, archive_name.parent, level, self.checksums)
+            if self.resume:
+                if resume:
+                    self.checkpoint = Checkpoint.load(self.checkpoint_path(db_name), self.resume_max_age * 3600)
                 else:
-                    import_sql += f"\n{load_sql}\n"
-                if indexes:
-                    if self.fast:
-                        index_sql += f'{indexes}\n'
-                    else:
-                        import_sql += f'{indexes}\n'
-                if index == (total - 1) or self.oft:
-                    if rocksdb:
-                        import_sql += 'SET session rocksdb_bulk_load=0;\n'
-                    file_name = f"{db_name}_{table_name}" if self.oft else db_name
-                    sql_file = f"{file_name}.sql"
-                    if self.oft:
-                        import_sql += f"\nANALYZE NO_WRITE_TO_BINLOG TABLE `{table_name}`;\n\n"
+                    self.checkpoint = Checkpoint(self.checkpoint_path(db_name))
+                self.checkpoint.structures = {table_name: self.ddl_hash(structure)
+                                              for table_name, structure in tables_structures.items()}
+                if resume:
+                    self.remove_unrecorded_files(db_name)
+            phase_start = time.time()
+            exports = []
+            with ImportScripts(self.SecureFilePriv, db_name, self.fast, self.oft, rocksdb) as scripts:
+                for table_name in tables:
+                    structure, indexes, primary_key, foreign_keys = tables_structures[table_name]
+                    if self.engine:
+                        structure = re.sub(r"ENGINE=\w+", f"ENGINE={self.engine}", structure)
+                    charset_pattern = r"CHARSET=(\w+)(?:\s+COLLATE=\w+)?"
+                    match = re.search(charset_pattern, structure)
+                    charset = ('CHARACTER SET %s' % match.group(1)) if match else ''
+                    reused_files = previous and previous.reusable(table_name, fingerprints.get(table_name), manifest.extension)
+                    if reused_files:
+                        reused[table_name] = reused_files
+                        chunks = [(file['chunk'], file['condition']) for file in reused_files]
                     else:
-                        tables_str = ','.join(f"`{t}`" for t in tables)
-                        analyze_sql = f"\nANALYZE NO_WRITE_TO_BINLOG TABLE {tables_str};\n\n"
-                        if self.fast:
-                            sql_file = f"1.{file_name}_structure.sql"
-                            load_sql_file = f"2.{file_name}_load.sql"
-                            with open(self.SecureFilePriv / load_sql_file, 'w') as file:
-                                file.write(load_data_sql)
-                            index_sql_file = f"3.{file_name}_index.sql"
-                            with open(self.SecureFilePriv / index_sql_file, 'w') as file:
-                                file.write(index_sql)
-                            analyze_sql_file = f"4.{file_name}_analyze.sql"
-                            with open(self.SecureFilePriv / analyze_sql_file, 'w') as file:
-                                file.write(analyze_sql)
-                            files = [sql_file, load_sql_file, index_sql_file, analyze_sql_file]
-                        else:
-                            import_sql += analyze_sql
-                    with open(self.SecureFilePriv / sql_file, 'w') as file:
-                        file.write(import_sql)
-            self.sql("COMMIT;")
-            duration = time.time() - start_time
-            if not self.log and not self.debug:
-                print(f"\tok {duration:7.2f}s")
+                        chunks = self.get_table_chunks(db_name, table_name, primary_key)
+                        linked = previous.reusable_partitions(
+                            table_name, fingerprints.get(table_name), partitions.get(table_name, {}), manifest.extension
+                        ) if previous else []
+                        linked = [file for file in linked if (file['chunk'], file['condition']) in chunks]
+                        if linked:
+                            reused[table_name] = linked
+                            partial.add(table_name)
+                        linked_chunks = {file['chunk'] for file in linked}
+                        exports += [(table_name, primary_key, chunk, condition) for chunk, condition in chunks if chunk not in linked_chunks]
+                    if manifest:
+                        data_files = []
+                        for chunk, condition in chunks:
+                            data_file = {'chunk': chunk, 'condition': condition,
+                                         'file': str(self.data_file(db_name, table_name, chunk).relative_to(self.SecureFilePriv))}
+                            if isinstance(chunk, str):
+                                data_file['fingerprint'] = partitions.get(table_name, {}).get(chunk)
+                            data_files.append(data_file)
+                        manifest.add_table(table_name, fingerprints.get(table_name), data_files)
+                    csv_sql = self.inline_sql if self.as_csv else ''
+                    sql = f'{charset} {csv_sql}'
+                    load_sql = '\n'.join(
+                        f"LOAD DATA INFILE '{self.data_file(db_name, table_name, chunk)}' INTO TABLE `{table_name}`"
+                        f"{self.partition_clause(chunk)} {sql};"
+                        for chunk, _ in chunks
+                    )
+                    scripts.add_table(table_name, structure, load_sql, indexes, foreign_keys)
+                    if self.indexed:
+                        self.write_table_script(db_name, table_name, structure, load_sql, indexes, foreign_keys, rocksdb)
+                scripts.close()
+            files = scripts.files
+            if self.checkpoint:
+                exports, resumed = self.skip_finished_tables(db_name, exports)
+                if manifest:
+                    # data of the resumed tables is from an earlier snapshot, the next backup must not reuse it
+                    for table_name in resumed:
+                        manifest.tables[table_name]['fingerprint'] = None
+            exports = self.schedule_exports(db_name, exports)
+            self.metrics.add_phase(db_name, 'scripts', time.time() - phase_start)
+            phase_start = time.time()
+            self.start_progress(db_name, exports)
+            try:
+                if reused:
+                    self.export_tables(db_name, exports, lambda: self.link_unchanged_tables(db_name, tables_structures, reused, previous))
+                else:
+                    self.export_tables(db_name, exports)
+            finally:
+                self.progress.stop()
+            self.metrics.add_phase(db_name, 'export', time.time() - phase_start)
+            if manifest:
+                for table in manifest.tables.values():
+                    for file in table['files']:
+                        file.update(self.checksums.files.get(file['file'], {}))
+                manifest.save()
+                self.data_directory = None
+            if self.dedup_store:
+                self.dedup_store.save()
+                reused_message = self.dedup_store.message()
+                self.dedup_store = None
             else:
-                logging.info(f"Export duration: {duration:7.2f}s")
-            if self.output:
-                archive_name = Path(self.output)
+                reused_message = f", {len(reused) - len(partial)} unchanged tables linked" if len(reused) > len(partial) else ''
+                if partial:
+                    linked_partitions = sum(len(reused[table_name]) for table_name in partial)
+                    reused_message += f", {linked_partitions} unchanged partitions of {len(partial)} tables linked"
+            self.checkpoint = None
+            duration = time.time() - start_time
+            throughput = self.progress.throughput()
+            self.progress = None
+            if self.interactive:
+                print(f"\tok {duration:7.2f}s {throughput}{reused_message}")
             else:
-                path = Path(self.path) if self.path else (self.backup_dir / self. get_suffix())
-                archive_name = path / f"{db_name}.tgz"
-            if self.oft:
-                files = [f"{db_name}_{table}.sql" for table in tables]
-            self.compress(archive_name, db_name, ' '.join(map(str, files)))
-            self.cleanup_output_folder(db_name)
+                logging.info(f"Export duration: {duration:7.2f}s {throughput}{reused_message}")
+            self.archive(archive_name, db_name, files, self.checksums)
         except mysql.connector.Error as error:
+            self.discard_stream_archive()
             if error.errno in retry_errors and attempt < self.sql_retry_attempts:
                 logging.warning(f'MySQL server error: {error}, attempting to retry database:{db_name} (attempt {attempt + 1})')
                 # у випадку коли запит переривається при SELECT * INTO OUTFILE '<file_data_path>' перезапускаємо архівування бази
@@ -350,61 +2210,498 @@ class Backup:
             logging.critical(f'Error during SQL query execution: {error}')
             die(error)
         except Exception as error:
+            self.discard_stream_archive()
             logging.critical(traceback.format_exc())
             die(error)
 
-    def cleanup_output_folder(self, db_name):
-        sql_file = self.SecureFilePriv / f"{db_name}.sql"
-        files = [self.SecureFilePriv / f"{db_name}.sql"]
+    def export_size(self, db_name, exports):
+        """Estimated size of every export: DATA_LENGTH of the partition or of the table split evenly between its chunks."""
+        chunks = {}
+        for export in exports:
+            chunks[export[0]] = chunks.get(export[0], 0) + 1
+        metadata = self.db_metadata(db_name)
+        sizes = []
+        for table_name, _, chunk, _ in exports:
+            table = metadata.get(table_name)
+            if not table:
+                sizes.append(0)
+            elif isinstance(chunk, str):
+                sizes.append(sum(partition['data_length'] for partition in table['partitions'] if partition['name'] == chunk))
+            else:
+                sizes.append(table['data_length'] // chunks[table_name])
+        return sizes
+
+    def schedule_exports(self, db_name, exports):
+        """Largest exports first, so a big table does not start last and keep one worker busy after the others are done."""
+        sizes = self.export_size(db_name, exports)
+        return [export for _, export in sorted(zip(sizes, exports), key=lambda item: item[0], reverse=True)]
+
+    def start_progress(self, db_name, exports):
+        """Progress of the export, shown on the dotted line of a terminal or logged every `progress_interval` seconds."""
+        total = sum(self.export_size(db_name, exports))
+        if not self.interactive:
+            self.progress = Progress(db_name, total, interval=self.progress_interval)
+        elif sys.stdout.isatty():
+            self.progress = Progress(db_name, total, f"Backing up database: {db_name} ".ljust(60, '.'), interval=1)
+        else:
+            # the dotted line is kept clean when the output goes to a file
+            self.progress = Progress(db_name, total)
+            return
+        self.progress.start_reporting()
+
+    def target_folder(self):
+        """Folder the archives are written to, the day folders are created in it."""
+        if self.output:
+            return Path(self.output).parent
+        return Path(self.path) if self.path else Path(self.backup_dir)
+
+    def archive_path(self, db_name):
+        if self.output:
+            return Path(self.output)
+        path = Path(self.path) if self.path else (self.backup_dir / self.get_suffix())
+        return path / f"{db_name}.{self.compressor.extension}"
+
+    def discard_stream_archive(self):
+        if self.stream_archive:
+            self.stream_archive.discard()
+            self.stream_archive = None
+
+    def checkpoint_path(self, db_name):
+        return self.SecureFilePriv / f"{db_name}.checkpoint.jsonl"
+
+    def stored_data_file(self, db_name, table_name, chunk=None):
+        data_file = self.data_file(db_name, table_name, chunk)
+        if self.data_directory:
+            return self.data_directory.target(data_file.relative_to(self.SecureFilePriv))
+        return data_file
+
+    def remove_unrecorded_files(self, db_name):
+        """Removes data files the checkpoint does not know, the export stopped halfway or its checkpoint was too old."""
+        folders = [self.SecureFilePriv / db_name]
+        if self.data_directory:
+            folders.append(self.data_directory.path / db_name)
+        for folder in folders:
+            if folder.is_dir():
+                for path in folder.rglob('*'):
+                    if path.is_file() and str(path) not in self.checkpoint.files:
+                        path.unlink()
+
+    def skip_finished_tables(self, db_name, exports):
+        """Drops exports of the tables finished by an earlier attempt.
+
+        A table is skipped only when all of its chunks are done, so every table is still read in one snapshot,
+        but different tables may come from different snapshots.
+        """
+        tables = {}
+        for export in exports:
+            tables.setdefault(export[0], []).append(export)
+        pending = []
+        resumed = []
+        for table_name, table_exports in tables.items():
+            if all(self.checkpoint.done(self.stored_data_file(db_name, table_name, chunk), table_name, condition)
+                   for _, _, chunk, condition in table_exports):
+                resumed.append(table_name)
+                for _, _, chunk, _ in table_exports:
+                    # the files are not read again, their checksums were recorded when they were written
+                    entry = self.checkpoint.files[str(self.stored_data_file(db_name, table_name, chunk))]
+                    self.checksums.add(self.data_file(db_name, table_name, chunk).relative_to(self.SecureFilePriv), **entry['checksums'])
+                continue
+            pending += table_exports
+        kept = {str(self.stored_data_file(db_name, table_name, chunk))
+                for table_name in resumed for _, _, chunk, _ in tables[table_name]}
+        # files of the pending tables, of chunks numbered differently now and of tables dropped or excluded since
+        for path in self.checkpoint.files:
+            if path not in kept and Path(path).exists():
+                Path(path).unlink()
+        if resumed:
+            logging.warning(f"Resuming '{db_name}': {len(resumed)} tables exported by an earlier attempt are kept, "
+                            f"they were read in an earlier snapshot than the rest of the database")
+        return pending, resumed
+
+    def import_scripts(self, db_name):
+        """Names of the import scripts of the database, a pattern would match scripts of `<db>_<suffix>` databases."""
         if self.oft:
-            files = self.SecureFilePriv.glob(f"{db_name}_*.sql")
-        elif self.fast:
-            files = (f"1.{db_name}_structure.sql", f"2.{db_name}_load.sql", f"3.{db_name}_index.sql", f"4.{db_name}_analyze.sql")
-        for file_path in files:
+            return [f"{db_name}_{table_name}.sql" for table_name in self.get_tables(db_name)]
+        if self.fast:
+            return [f"1.{db_name}_structure.sql", f"2.{db_name}_load.sql", f"3.{db_name}_index.sql",
+                    f"4.{db_name}_analyze.sql", f"5.{db_name}_foreign_keys.sql"]
+        return [f"{db_name}.sql"]
+
+    def cleanup_output_folder(self, db_name, keep_data=False, sql_files=None):
+        """Removes the staged files of the database, `sql_files` are the scripts written for it, by default all it may have."""
+        start_time = time.time()
+        if sql_files is None:
+            sql_files = self.import_scripts(db_name)
+        for file_name in sql_files:
+            sql_file = self.SecureFilePriv / file_name
             try:
-                sql_file = Path(file_path)
-                sql_file.exists() and Path(file_path).unlink()
+                if sql_file.exists():
+                    logging.debug(f'Removing {sql_file}')
+                    sql_file.unlink()
             except Exception as e:
-                print(f"Error deleting file {file_path}: {e}")
-
-        if sql_file.exists():
-            logging.debug(f'Removing {sql_file}')
-            sql_file.unlink()
-        output_folder = self.SecureFilePriv / db_name
-        if output_folder.exists():
-            shutil.rmtree(output_folder)
-
-    def get_db_tables(self, db_name):
-        self.sql(f"SHOW TABLES FROM `{db_name}`")
-        return [t[0] for t in self.cursor.fetchall()]
-
-    def get_table_structure(self, db_name, table_name, separate_indexes, rocksdb):
-        self.sql(f"SHOW CREATE TABLE `{db_name}`.`{table_name}`")
-        create_table_stmt = self.cursor.fetchone()[1]
+                print(f"Error deleting file {sql_file}: {e}")
+        if not keep_data:
+            checkpoint_file = self.checkpoint_path(db_name)
+            if checkpoint_file.exists():
+                checkpoint_file.unlink()
+            output_folder = self.SecureFilePriv / db_name
+            if output_folder.exists():
+                shutil.rmtree(output_folder)
+        self.metrics.add_phase(db_name, 'cleanup', time.time() - start_time)
+
+    def write_table_script(self, db_name, table_name, structure, load_sql, indexes, foreign_keys, rocksdb):
+        """Script of one table next to its data files, `--extract` restores the table with it alone."""
+        script = 'SET session foreign_key_checks=0;\n'
+        if rocksdb:
+            script += 'SET session sql_log_bin=0;\nSET session rocksdb_bulk_load=1;\n'
+        script += f'DROP TABLE IF EXISTS `{table_name}`;\n{structure};\n\n{load_sql}\n'
+        if rocksdb:
+            script += 'SET session rocksdb_bulk_load=0;\n'
+        if indexes:
+            script += f'{indexes}\n'
+        if foreign_keys:
+            script += f'{foreign_keys}\n'
+        script += f'SET session foreign_key_checks=1;\n\nANALYZE NO_WRITE_TO_BINLOG TABLE `{table_name}`;\n'
+        with open(self.output_folder(db_name) / f'{table_name}.sql', 'w') as file:
+            file.write(script)
+
+    def get_tables_structures(self, db_name, table_names, rocksdb):
+        """Structures of the tables, fetched over `jobs` connections at once.
+
+        A table dropped after the metadata was loaded is skipped.
+        """
+        if self.jobs < 2 or len(table_names) < 2:
+            structures = [self.get_table_structure(db_name, table_name, self.separate_index, rocksdb) for table_name in table_names]
+        else:
+            workers = queue.Queue()
+            try:
+                for _ in range(min(self.jobs, len(table_names))):
+                    workers.put(self.connect_worker())
+                with ThreadPoolExecutor(max_workers=workers.qsize()) as pool:
+                    structures = list(pool.map(
+                        lambda table_name: self.structure_with_worker(workers, db_name, table_name, rocksdb), table_names
+                    ))
+            finally:
+                self.close_workers(workers)
+        return {table_name: structure for table_name, structure in zip(table_names, structures) if structure}
+
+    def structure_with_worker(self, workers, db_name, table_name, rocksdb):
+        conn, cursor = workers.get()
+        try:
+            return self.get_table_structure(db_name, table_name, self.separate_index, rocksdb, cursor)
+        finally:
+            workers.put((conn, cursor))
+
+    def get_table_structure(self, db_name, table_name, separate_indexes, rocksdb, cursor=None):
+        cursor = cursor or self.cursor
+        try:
+            self.sql(f"SHOW CREATE TABLE `{db_name}`.`{table_name}`", cursor)
+        except mysql.connector.Error as error:
+            if error.errno != errorcode.ER_NO_SUCH_TABLE:
+                raise
+            logging.warning(f"Table `{db_name}`.`{table_name}` was dropped, skipping it")
+            return None
+        create_table_stmt = cursor.fetchone()[1]
         if separate_indexes:
             # Розділяємо CREATE TABLE на структуру та індекси
-            structure_part, indexes_part, primary_key = self.separate_structure_and_indexes(create_table_stmt, rocksdb)
-            return structure_part, indexes_part, primary_key
-        return create_table_stmt, None, None
+            return self.separate_structure_and_indexes(create_table_stmt, rocksdb, self.index_algorithm)
+        return create_table_stmt, None, None, None
+
+    def table_fingerprints(self, db_name, tables_structures, cached=False):
+        """Values which change when the table is changed, incremental backups compare them with the previous run.
+
+        `cached` takes them from the metadata loaded at the start of the run instead of asking the server again.
+        """
+        if cached:
+            rows = [(table_name, table['engine'], table['update_time'], table['rows'], table['create_options'])
+                    for table_name, table in self.db_metadata(db_name).items()]
+        else:
+            self.sql(f"SELECT TABLE_NAME, ENGINE, UPDATE_TIME, TABLE_ROWS, CREATE_OPTIONS FROM information_schema.TABLES "
+                     f"WHERE TABLE_SCHEMA = '{db_name}'")
+            rows = self.cursor.fetchall()
+        fingerprints = {}
+        for table_name, engine, update_time, table_rows, create_options in rows:
+            if table_name not in tables_structures:
+                continue
+            if (engine or '').lower() not in UPDATE_TIME_ENGINES:
+                # without UPDATE_TIME the table is never reused
+                update_time = None
+            fingerprints[table_name] = {
+                'update_time': update_time.isoformat() if update_time else None,
+                'rows': table_rows,
+                'ddl': self.ddl_hash(tables_structures[table_name]),
+            }
+            if 'checksum=1' in (create_options or '').lower():
+                # live checksum is maintained by the engine, reading it does not scan the table
+                self.sql(f"CHECKSUM TABLE `{db_name}`.`{table_name}` QUICK")
+                fingerprints[table_name]['checksum'] = self.cursor.fetchone()[1]
+        return fingerprints
+
+    @staticmethod
+    def ddl_hash(table_structure):
+        structure, indexes, _, foreign_keys = table_structure
+        return hashlib.sha1(f'{structure}\n{indexes}\n{foreign_keys}'.encode()).hexdigest()
+
+    def link_unchanged_tables(self, db_name, tables_structures, reused, previous):
+        """Hard links data files of the tables reused from the previous backup, called once the snapshot is taken.
+
+        Fingerprints are checked again, a table changed after the first check is exported with the same chunks.
+        """
+        fingerprints = self.table_fingerprints(db_name, {table_name: tables_structures[table_name] for table_name in reused})
+        partitioned = any(isinstance(file['chunk'], str) for files in reused.values() for file in files)
+        partitions = self.partition_fingerprints(db_name) if partitioned else {}
+        exports = []
+        for table_name, files in reused.items():
+            if previous.reusable(table_name, fingerprints.get(table_name), previous.extension) == files:
+                unchanged = files
+            else:
+                unchanged = previous.reusable_partitions(
+                    table_name, fingerprints.get(table_name), partitions.get(table_name, {}), previous.extension
+                )
+            for file in files:
+                if file not in unchanged:
+                    continue
+                self.data_directory.link(previous.stored_path(file['file']), file['file'])
+                if 'blake2b' in file:
+                    self.checksums.add(file['file'], size=file['size'], blake2b=file['blake2b'], rows=file.get('rows'), stored='directory')
+            changed = [file for file in files if file not in unchanged]
+            if changed:
+                logging.info(f"Table `{table_name}` changed while the backup was starting, exporting it")
+                primary_key = tables_structures[table_name][2]
+                exports += [(table_name, primary_key, file['chunk'], file['condition']) for file in changed]
+        return exports
+
+    def partition_fingerprints(self, db_name, cached=False):
+        """UPDATE_TIME and row estimate of every partition, incremental backups link the partitions which have not changed.
+
+        Subpartitions are merged into their partition, it is read and linked as a whole.
+        """
+        if cached:
+            rows = [(table_name, partition['name'], partition['rows'], partition['update_time'])
+                    for table_name, table in self.db_metadata(db_name).items() for partition in table['partitions']]
+        else:
+            self.sql("SELECT TABLE_NAME, PARTITION_NAME, TABLE_ROWS, UPDATE_TIME FROM information_schema.PARTITIONS "
+                     f"WHERE TABLE_SCHEMA = '{db_name}' AND PARTITION_NAME IS NOT NULL")
+            rows = self.cursor.fetchall()
+        engines = {table_name: (table['engine'] or '').lower() for table_name, table in self.db_metadata(db_name).items()}
+        fingerprints = {}
+        for table_name, partition_name, table_rows, update_time in rows:
+            if engines.get(table_name) not in UPDATE_TIME_ENGINES:
+                update_time = None
+            partitions = fingerprints.setdefault(table_name, {})
+            # read by a session with information_schema_stats_expiry = 0, partitions of older manifests are exported again
+            fingerprint = {'update_time': update_time.isoformat() if update_time else None, 'rows': table_rows or 0, 'fresh': True}
+            known = partitions.get(partition_name)
+            if known:
+                times = (known['update_time'], fingerprint['update_time'])
+                fingerprint = {'update_time': max(times) if all(times) else None, 'rows': known['rows'] + fingerprint['rows'],
+                               'fresh': True}
+            partitions[partition_name] = fingerprint
+        return fingerprints
 
-    def export_table_data(self, db_name, table_name, primary_key):
+    def export_tables(self, db_name, exports, after_snapshot=None):
+        if self.jobs < 2 or len(exports) < 2:
+            self.sql("START TRANSACTION WITH CONSISTENT SNAPSHOT;")
+            if after_snapshot:
+                exports = exports + after_snapshot()
+            for export in exports:
+                with self.disk_guard, self.throttle:
+                    self.export_table_data(db_name, *export)
+            self.sql("COMMIT;")
+            return
+        workers = self.open_workers(min(self.jobs, len(exports)))
+        try:
+            if after_snapshot:
+                exports = exports + after_snapshot()
+            with ThreadPoolExecutor(max_workers=workers.qsize()) as pool:
+                self.wait_all([pool.submit(self.export_with_worker, workers, db_name, export) for export in exports])
+        finally:
+            self.close_workers(workers)
+
+    @staticmethod
+    def wait_all(futures):
+        """Waits for the futures, the first error cancels the ones not started yet."""
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def open_workers(self, count):
+        """Opens `count` connections which see the same consistent snapshot.
+
+        The connections are opened and configured first, the global read lock is held only while
+        every worker starts its transaction, so all of them read the data as it was at the same moment.
+        """
+        workers = queue.Queue()
+        try:
+            for _ in range(count):
+                workers.put(self.connect_worker())
+            self.sql("FLUSH TABLES WITH READ LOCK")
+            try:
+                for conn, cursor in list(workers.queue):
+                    self.sql("START TRANSACTION WITH CONSISTENT SNAPSHOT;", cursor)
+            finally:
+                self.sql("UNLOCK TABLES")
+        except BaseException:
+            self.close_workers(workers)
+            raise
+        return workers
+
+    def connect_worker(self):
+        conn = mysql.connector.connect(**self.db_config)
+        cursor = conn.cursor()
+        try:
+            self.configure_session(cursor)
+        except BaseException:
+            conn.close()
+            raise
+        return conn, cursor
+
+    @staticmethod
+    def close_workers(workers):
+        while not workers.empty():
+            conn, cursor = workers.get()
+            try:
+                cursor.close()
+                conn.close()
+            except Exception as e:
+                logging.warning(f'Error closing MySQL worker connection: {e}')
+
+    def export_with_worker(self, workers, db_name, export):
+        conn, cursor = workers.get()
+        try:
+            with self.disk_guard, self.throttle:
+                self.export_table_data(db_name, *export, cursor=cursor, conn=conn)
+        finally:
+            workers.put((conn, cursor))
+
+    def get_table_chunks(self, db_name, table_name, primary_key):
+        """Splits the table into its partitions or into ranges of an integer primary key.
+
+        Returns list of (chunk number or partition name, WHERE condition); [(None, None)] means the table is exported as one file.
+        The first and the last ranges are open, so rows outside of the estimated MIN/MAX are never lost.
+        """
+        table = self.db_metadata(db_name).get(table_name)
+        if table and table['partitions']:
+            # every partition is read on its own with PARTITION (...), subpartitions are read with their partition
+            return [(name, None) for name in dict.fromkeys(partition['name'] for partition in table['partitions'])]
+        if not (self.chunk_rows or self.chunk_size) or not primary_key or ',' in primary_key:
+            return [(None, None)]
+        if not table or len(table['primary_key']) != 1 or table['primary_key'][0][1] not in INTEGER_TYPES:
+            return [(None, None)]
+        table_rows, avg_row_length = table['rows'], table['avg_row_length']
+        rows_per_chunk = self.chunk_rows or table_rows
+        if self.chunk_size:
+            rows_per_chunk = min(rows_per_chunk, self.chunk_size // max(avg_row_length or 1, 1))
+        count = -(-table_rows // max(rows_per_chunk, 1))
+        if count < 2:
+            return [(None, None)]
+        self.sql(f"SELECT MIN({primary_key}), MAX({primary_key}) FROM `{db_name}`.`{table_name}`")
+        low, high = self.cursor.fetchone()
+        if not isinstance(low, int) or not isinstance(high, int) or low == high:
+            return [(None, None)]
+        step = max(-(-(high - low + 1) // count), 1)
+        bounds = list(range(low + step, high + 1, step))
+        if not bounds:
+            return [(None, None)]
+        conditions = [f"{primary_key} < {bounds[0]}"]
+        conditions += [f"{primary_key} >= {start} AND {primary_key} < {end}" for start, end in zip(bounds, bounds[1:])]
+        conditions.append(f"{primary_key} >= {bounds[-1]}")
+        return list(enumerate(conditions, 1))
+
+    def data_file(self, db_name, table_name, chunk=None):
+        ext = 'csv' if self.as_csv else 'data'
+        if isinstance(chunk, str):
+            name = f'{table_name}.{chunk}.{ext}'
+        else:
+            name = f'{table_name}.{chunk:05d}.{ext}' if chunk else f'{table_name}.{ext}'
+        return self.SecureFilePriv / db_name / name
+
+    @staticmethod
+    def partition_clause(chunk):
+        return f' PARTITION (`{chunk}`)' if isinstance(chunk, str) else ''
+
+    def output_folder(self, db_name):
         archive_folder = self.SecureFilePriv / db_name
         if not archive_folder.exists():
             archive_folder.mkdir(parents=True, exist_ok=True)
-            try:
-                os.chown(archive_folder, pwd.getpwnam('mysql').pw_uid, grp.getgrnam('mysql').gr_gid)
-            except Exception as error:
-                logging.warning(f"Can not change owner of {archive_folder}: {error}")
-                exit(1)
+            if not self.client_export:
+                try:
+                    os.chown(archive_folder, pwd.getpwnam('mysql').pw_uid, grp.getgrnam('mysql').gr_gid)
+                except Exception as error:
+                    logging.warning(f"Can not change owner of {archive_folder}: {error}")
+                    exit(1)
+        return archive_folder
+
+    def export_table_data(self, db_name, table_name, primary_key, chunk=None, condition=None, cursor=None, conn=None):
+        self.output_folder(db_name)
         sql = self.inline_sql if self.as_csv else ''
-        ext = 'csv' if self.as_csv else 'data'
         sort = f'ORDER BY {primary_key}' if primary_key else ''
-        data_file = self.SecureFilePriv / db_name / f'{table_name}.{ext}'
-        sql_query = f"SELECT * INTO OUTFILE '{data_file}' {sql} FROM `{db_name}`.`{table_name}` {sort}"
-        self.sql(sql_query)
+        where = f'WHERE {condition} ' if condition else ''
+        data_file = self.data_file(db_name, table_name, chunk)
+        start_time = time.time()
+        counter = {'rows': 0}
+        partition = self.partition_clause(chunk)
+        client_query = f"SELECT * FROM `{db_name}`.`{table_name}`{partition} {where}{sort}"
+        if self.progress:
+            self.progress.start(data_file)
+        if self.client_export and self.data_directory:
+            # rows go straight into the compressed file, nothing is staged
+            rows = self.fetch_rows(client_query, conn, counter)
+            if self.progress:
+                rows = self.progress.track(data_file, rows)
+            stored_file = self.data_directory.write(data_file.relative_to(self.SecureFilePriv), rows)
+            size = self.progress.finish(data_file) if self.progress else 0
+        else:
+            if self.client_export:
+                with open(data_file, 'wb') as file:
+                    file.writelines(self.fetch_rows(client_query, conn, counter))
+            else:
+                sql_query = f"SELECT * INTO OUTFILE '{data_file}' {sql} FROM `{db_name}`.`{table_name}`{partition} {where}{sort}"
+                self.sql(sql_query, cursor)
+                counter['rows'] = max((cursor or self.cursor).rowcount, 0)
+            size = self.progress.finish(data_file) if self.progress else data_file.stat().st_size
+            target = self.data_directory or self.dedup_store or self.stream_archive
+            if target:
+                # the file is not needed in staging once it is in the archive
+                stored_file = target.add(data_file, data_file.relative_to(self.SecureFilePriv), remove=True)
+            else:
+                stored_file = data_file
+        self.metrics.add_table(db_name, table_name, time.time() - start_time, size, counter['rows'])
+        if self.checksums:
+            self.checksums.add(data_file.relative_to(self.SecureFilePriv), rows=counter['rows'])
+            if self.table_checksums and self.checksums.first_export(table_name):
+                # read in the snapshot of the export, the table restored from this backup has the same checksum
+                self.sql(f"CHECKSUM TABLE `{db_name}`.`{table_name}`", cursor)
+                self.checksums.add_table(table_name, checksum=(cursor or self.cursor).fetchone()[1])
+        if self.checkpoint:
+            self.checkpoint.add(stored_file, table_name, condition, self.checksums.get(data_file.relative_to(self.SecureFilePriv)) if self.checksums else None)
+
+    def fetch_rows(self, query, conn=None, counter=None):
+        """Rows of the query encoded as data file blocks, read in batches of `client_batch_rows` by an unbuffered cursor.
+
+        The number of rows read is added to `counter['rows']`.
+        """
+        cursor = (conn or self.conn).cursor(raw=True)
+        try:
+            self.sql(query, cursor)
+            enclosed = [column[1] in ENCLOSED_FIELD_TYPES for column in cursor.description] if self.as_csv else None
+            for rows in iter(lambda: cursor.fetchmany(self.client_batch_rows), []):
+                if counter is not None:
+                    counter['rows'] += len(rows)
+                yield from encode_rows([rows], enclosed)
+        finally:
+            cursor.close()
 
     @staticmethod
-    def separate_structure_and_indexes(create_stmt, rocksdb=False):
+    def separate_structure_and_indexes(create_stmt, rocksdb=False, algorithm=None):
+        """Splits CREATE TABLE into the structure, one ALTER TABLE adding all secondary indexes and one adding foreign keys.
+
+        A single ALTER builds every index in one pass over the loaded table instead of one pass per index.
+        """
         # Витягуємо назву таблиці, її структуру і індекси
         match = re.search(r'CREATE TABLE `([\w-]+)`\s*\((.*)\)\s*(ENGINE=[^\n]+)(.*?(/\*.*?\*/))?', create_stmt, re.DOTALL)
         if not match:
@@ -419,6 +2716,8 @@ class Backup:
         # Розділяємо структуру на поля та індекси
         fields_and_indexes = full_structure.split(",\n  ")
         structure_fields = [field.strip() for field in fields_and_indexes if not re.match(r'KEY|INDEX|UNIQUE', field)]
+        foreign_keys = [field for field in structure_fields if re.match(r'(CONSTRAINT `[^`]+` )?FOREIGN KEY', field)]
+        structure_fields = [field for field in structure_fields if field not in foreign_keys]
         indexes = [field.strip() for field in fields_and_indexes if re.match(r'KEY|INDEX|UNIQUE', field) and 'PRIMARY KEY' not in field]
         allow_unsorted = False
         if rocksdb:
@@ -432,14 +2731,16 @@ class Backup:
                 allow_unsorted = True
         fields = ",\n  ".join(structure_fields)
         structure_part = f"CREATE TABLE `{table_name}` (\n{fields}\n) {table_settings}"
-        indexes_part = "\n".join([f"ALTER TABLE `{table_name}` ADD {index};" for index in indexes])
+        algorithm_part = f", ALGORITHM={algorithm}" if algorithm else ''
+        indexes_part = f"ALTER TABLE `{table_name}` {', '.join(f'ADD {index}' for index in indexes)}{algorithm_part};" if indexes else ''
+        foreign_keys_part = f"ALTER TABLE `{table_name}` {', '.join(f'ADD {key}' for key in foreign_keys)};" if foreign_keys else None
         if allow_unsorted and rocksdb:
-            index_str = (',\n' + ',\n'.join(indexes) + ')\n') if indexes else '\n'
+            index_str = (',\n' + ',\n'.join(indexes) + ')\n') if indexes else '\n)'
             return f"""
                 SET session rocksdb_bulk_load_allow_unsorted=1;
                 CREATE TABLE `{table_name}` (\n{fields}{index_str} {table_settings};
-                SET session rocksdb_bulk_load_allow_unsorted=0;""", None, None
-        return structure_part, indexes_part, primary_key_name
+                SET session rocksdb_bulk_load_allow_unsorted=0;""", None, None, foreign_keys_part
+        return structure_part, indexes_part, primary_key_name, foreign_keys_part
 
     @staticmethod
     def get_suffix(day=7):
@@ -469,6 +2770,8 @@ class Backup:
                 continue
         self.remove_old_directories(weekdays_dirs, self.weekday_limit)
         self.remove_old_directories(sunday_dirs, self.sunday_limit)
+        # the chunks of the removed backups are freed once no other backup refers to them
+        DedupStore.collect_garbage(backup_path, self.metrics.started)
 
     @staticmethod
     def remove_old_directories(directories, limit):
@@ -477,9 +2780,14 @@ class Backup:
             logging.debug(f"Removing folder: {dir_to_remove}")
             shutil.rmtree(dir_to_remove)
 
-    def compress(self, file_name, db_name, sql_files):
-        backup_dir = file_name.parent
-        start_time = time.time()
+    def open_archive(self, file_name, checksums=None):
+        self.prepare_backup_dir(file_name.parent)
+        if self.indexed:
+            return IndexedArchiveWriter(file_name, self.compressor, checksums)
+        return ArchiveWriter(file_name, self.compressor, checksums)
+
+    @staticmethod
+    def prepare_backup_dir(backup_dir):
         today_date = datetime.now().strftime("%Y%m%d")
         if backup_dir.exists():
             mtime = datetime.fromtimestamp(backup_dir.stat().st_mtime)
@@ -489,17 +2797,456 @@ class Backup:
                 if not new_dir_name.exists():
                     shutil.move(str(backup_dir), str(new_dir_name))
         backup_dir.mkdir(parents=True, exist_ok=True)
-        if not self.log and not self.debug:
+
+    def compress(self, file_name, db_name, sql_files, checksums=None):
+        start_time = time.time()
+        if self.interactive:
             print(f"Compressing {file_name} ".ljust(60, '.'), flush=True, end='')
         else:
             logging.info(f"Compressing {file_name}")
-        command = f'{self.nice} tar -chzf {file_name} -C {self.SecureFilePriv} {db_name} {sql_files}'
-        self.execute(command)
+        # in stream mode the data files are already in the archive, only the scripts are left
+        archive = self.stream_archive or self.open_archive(file_name, checksums)
+        self.stream_archive = None
+        try:
+            if (self.SecureFilePriv / db_name).exists():
+                archive.add(self.SecureFilePriv / db_name, db_name)
+            for sql_file in sql_files:
+                archive.add(self.SecureFilePriv / sql_file, sql_file)
+            archive.close()
+        except BaseException:
+            archive.discard()
+            raise
+        duration = time.time() - start_time
+        self.metrics.add_phase(db_name, 'compression', duration)
+        self.metrics.set_archive_size(db_name, Path(file_name).stat().st_size)
+        if self.interactive:
+            print(f"\tok {duration:7.2f}s {archive.throughput()}")
+        else:
+            logging.info(f"Compress duration {duration:7.2f}s {archive.throughput()}")
+
+    def restore(self, archive):
+        """Restores the database from its archive.
+
+        For the `--fast` layout the data is loaded over `jobs` connections, largest files first,
+        then indexes are built for several tables at once. Other layouts run their scripts one connection per file.
+        """
+        archive = Path(archive)
+        if not archive.is_file():
+            die(f"Archive {archive} does not exist.")
+        compressor = compressor_for(archive.name)
+        db_name = self.archive_db_name(archive, compressor)
+        if (self.SecureFilePriv / db_name).exists():
+            die(f"Folder {self.SecureFilePriv / db_name} is in use, remove it before the restore")
+        names = []
+        try:
+            self.restore_step(f"Unpacking {archive}", self.unpack_archive, archive, compressor, names)
+            manifest_path = Manifest.file_path(archive.parent, db_name)
+            if manifest_path.is_file():
+                manifest = Manifest.load(manifest_path, db_name)
+                if not manifest:
+                    die(f"Can not read manifest {manifest_path}")
+                self.restore_step(f"Unpacking data files of {db_name}", self.unpack_data_files, manifest, names)
+            chunk_list = DedupStore.file_path(archive.parent, db_name)
+            if chunk_list.is_file():
+                self.restore_step(f"Assembling data files of {db_name}", self.assemble_data_files, chunk_list, names)
+            scripts = sorted(name for name in names if '/' not in name and name.endswith('.sql'))
+            fast = [re.fullmatch(r'1\.(.+)_structure\.sql', name) for name in scripts]
+            fast = [match.group(1) for match in fast if match]
+            if fast:
+                self.restore_fast(fast[0])
+            else:
+                self.restore_step(f"Restoring {db_name}", self.run_parallel,
+                                  [self.read_script(name) for name in scripts])
+            if Checksums.member in names:
+                checksums = Checksums.loads((self.SecureFilePriv / Checksums.member).read_text())
+                if any('checksum' in table for table in checksums.tables.values()):
+                    self.restore_step(f"Checking tables of {db_name}", self.check_tables, db_name, checksums)
+        finally:
+            self.remove_unpacked(names)
+
+    @staticmethod
+    def archive_db_name(archive, compressor):
+        return archive.name[:-len(compressor.extension) - 1] if archive.name.endswith(f'.{compressor.extension}') else archive.stem
+
+    def check_tables(self, db_name, checksums):
+        """Compares `CHECKSUM TABLE` of the restored tables with the values read in the snapshot of the backup."""
+        mismatches = []
+        for table_name, table in sorted(checksums.tables.items()):
+            if 'checksum' not in table:
+                continue
+            self.sql(f"CHECKSUM TABLE `{db_name}`.`{table_name}`")
+            checksum = self.cursor.fetchone()[1]
+            if checksum != table['checksum']:
+                mismatches.append(f"`{table_name}` checksum {checksum}, {table['checksum']} in the backup")
+        if mismatches:
+            die(f"Restored tables of {db_name} differ from the backup: {'; '.join(mismatches)}")
+
+    def verify(self, archive, rows=False):
+        """Checks every file of the backup against the checksums saved in its archive, reading each file once.
+
+        With `rows` the rows of the data files are counted as well and compared with the rows exported in the snapshot.
+        """
+        archive = Path(archive)
+        if not archive.is_file():
+            die(f"Archive {archive} does not exist.")
+        compressor = compressor_for(archive.name)
+        db_name = self.archive_db_name(archive, compressor)
+        start_time = time.time()
+        members = {}
+        checksums = None
+        stream = compressor.open_reader(archive)
+        try:
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                for member in tar:
+                    if not member.isreg():
+                        continue
+                    if member.name == Checksums.member:
+                        checksums = Checksums.loads(tar.extractfile(member).read())
+                    else:
+                        file = tar.extractfile(member)
+                        members[member.name] = self.file_checksum(iter(lambda: file.read(1024 * 1024), b''), rows)
+        except (tarfile.TarError, OSError, EOFError, zlib.error) as e:
+            die(f"Archive {archive} is damaged: {e}")
+        finally:
+            stream.close()
+        if checksums is None:
+            die(f"Archive {archive} has no {Checksums.member}, it is truncated or was made without checksums")
+        manifest_path = Manifest.file_path(archive.parent, db_name)
+        manifest = Manifest.load(manifest_path, db_name) if manifest_path.is_file() else None
+        chunk_list_path = DedupStore.file_path(archive.parent, db_name)
+        chunk_list = DedupStore.load(chunk_list_path) if chunk_list_path.is_file() else None
+        errors = []
+        for name, expected in sorted(checksums.files.items()):
+            stored = expected.get('stored')
+            try:
+                if stored == 'archive':
+                    actual = members.pop(name, None)
+                elif stored == 'directory' and manifest:
+                    reader = compressor_for(DataDirectory.stored_name('data', manifest.extension)).open_reader(manifest.stored_path(name))
+                    try:
+                        actual = self.file_checksum(iter(lambda: reader.read(1024 * 1024), b''), rows)
+                    finally:
+                        reader.close()
+                elif stored == 'chunks' and chunk_list and name in chunk_list['files']:
+                    actual = self.file_checksum(self.read_chunks(chunk_list_path, chunk_list, name), rows)
+                else:
+                    actual = None
+            except (OSError, EOFError, zlib.error, ValueError) as e:
+                errors.append(f"{name}: {e}")
+                continue
+            if actual is None:
+                errors.append(f"{name}: missing")
+            elif (actual['size'], actual['blake2b']) != (expected.get('size'), expected.get('blake2b')):
+                errors.append(f"{name}: checksum mismatch")
+            elif rows and expected.get('rows') is not None and actual['rows'] != expected['rows']:
+                errors.append(f"{name}: {actual['rows']} rows, {expected['rows']} exported")
+        errors += [f"{name}: not in {Checksums.member}" for name in sorted(members)]
+        if errors:
+            die(f"Backup {archive} is damaged: {'; '.join(errors)}")
+        print(f"Verified {archive} in {time.time() - start_time:.2f}s: {len(checksums.files)} files ok")
+
+    @staticmethod
+    def file_checksum(blocks, rows=False):
+        """Size and blake2b of the file read in blocks, with `rows` also its rows."""
+        digest = Checksums.hasher()
+        counter = RowCounter() if rows else None
+        size = 0
+        for block in blocks:
+            digest.update(block)
+            size += len(block)
+            if counter:
+                counter.add(block)
+        return {'size': size, 'blake2b': digest.hexdigest(), 'rows': counter.rows if counter else None}
+
+    @staticmethod
+    def read_chunks(chunk_list_path, chunk_list, name):
+        """Blocks of the data file joined from its chunks, every chunk is checked against the sha256 it is stored under."""
+        path = Path(chunk_list_path).parent.parent / 'chunks'
+        for digest, size in chunk_list['files'][name]:
+            chunk = DedupStore.chunk_path(path, digest, chunk_list['compressed']).read_bytes()
+            chunk = gzip.decompress(chunk) if chunk_list['compressed'] else chunk
+            if len(chunk) != size or hashlib.sha256(chunk).hexdigest() != digest:
+                raise ValueError(f"chunk {digest} is damaged")
+            yield chunk
+
+    def restore_fast(self, db_name):
+        structure = self.read_script(f"1.{db_name}_structure.sql")
+        session_sql = [f"USE `{db_name}`"]
+        final_sql = []
+        if any('rocksdb_bulk_load=1' in statement for statement in structure):
+            # bulk load is a session setting, every connection enables it and commits it at the end
+            session_sql += ['SET session sql_log_bin=0', 'SET session rocksdb_bulk_load=1']
+            final_sql.append('SET session rocksdb_bulk_load=0')
+        loads = self.read_script(f"2.{db_name}_load.sql")
+        sizes = {statement: self.load_file_size(statement) for statement in loads}
+        table_sizes = {}
+        for statement, size in sizes.items():
+            table_name = re.search(r"INTO TABLE `([^`]+)`", statement).group(1)
+            table_sizes[table_name] = table_sizes.get(table_name, 0) + size
+        indexes = {}
+        for statement in self.read_script(f"3.{db_name}_index.sql"):
+            # indexes of one table are added one after another, a concurrent ALTER would wait for the lock anyway
+            indexes.setdefault(re.match(r"ALTER TABLE `([^`]+)`", statement).group(1), []).append(statement)
+        self.restore_step(f"Creating tables of {db_name}", self.run_statements, structure)
+        self.restore_step(f"Loading data of {db_name}", self.run_parallel,
+                          [[statement] for statement in sorted(loads, key=sizes.get, reverse=True)], session_sql, final_sql)
+        self.restore_step(f"Building indexes of {db_name}", self.run_parallel,
+                          [indexes[table_name] for table_name in sorted(indexes, key=lambda t: table_sizes.get(t, 0), reverse=True)],
+                          [f"USE `{db_name}`"])
+        self.restore_step(f"Analyzing tables of {db_name}", self.run_statements,
+                          [f"USE `{db_name}`"] + self.read_script(f"4.{db_name}_analyze.sql"))
+        if (self.SecureFilePriv / f"5.{db_name}_foreign_keys.sql").exists():
+            self.restore_step(f"Adding foreign keys of {db_name}", self.run_statements,
+                              self.read_script(f"5.{db_name}_foreign_keys.sql"))
+
+    def restore_step(self, title, function, *args):
+        start_time = time.time()
+        if self.interactive:
+            print(f"{title} ".ljust(60, '.'), flush=True, end='')
+        else:
+            logging.info(title)
+        function(*args)
         duration = time.time() - start_time
-        if not self.log and not self.debug:
+        if self.interactive:
             print(f"\tok {duration:7.2f}s")
         else:
-            logging.info(f"Compress duration {duration:7.2f}s")
+            logging.info(f"{title} duration {duration:7.2f}s")
+
+    def unpack_archive(self, archive, compressor, names, offset=0, length=None):
+        stream = compressor.open_reader(archive, offset, length)
+        try:
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extraction_filter = tarfile.data_filter
+                for member in tar:
+                    names.append(member.name)
+                    tar.extract(member, self.SecureFilePriv)
+        finally:
+            stream.close()
+
+    def unpack_data_files(self, manifest, names, table_names=None):
+        """Decompresses data files of an incremental backup, they are kept next to the archive."""
+        compressor = compressor_for(DataDirectory.stored_name('data', manifest.extension))
+        for table_name, table in manifest.tables.items():
+            if table_names is not None and table_name not in table_names:
+                continue
+            for file in table['files']:
+                target = self.SecureFilePriv / file['file']
+                target.parent.mkdir(parents=True, exist_ok=True)
+                names.append(file['file'])
+                stream = compressor.open_reader(manifest.stored_path(file['file']))
+                try:
+                    with open(target, 'wb') as output:
+                        shutil.copyfileobj(stream, output, 1024 * 1024)
+                finally:
+                    stream.close()
+
+    def assemble_data_files(self, chunk_list, names, pattern=None):
+        """Joins the chunks of a `--dedup` backup into data files, the chunks are in `chunks` next to its day folder."""
+        data = DedupStore.load(chunk_list)
+        if data is None:
+            die(f"Can not read chunk list {chunk_list}")
+        for name in data['files']:
+            if pattern and not pattern.fullmatch(name):
+                continue
+            target = self.SecureFilePriv / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            names.append(name)
+            with open(target, 'wb') as output:
+                try:
+                    output.writelines(self.read_chunks(chunk_list, data, name))
+                except ValueError as e:
+                    die(f"Can not assemble {name}: {e}")
+
+    def remove_unpacked(self, names):
+        for top in sorted({name.split('/')[0] for name in names}):
+            path = self.SecureFilePriv / top
+            if path.is_dir():
+                shutil.rmtree(path)
+            elif path.exists():
+                path.unlink()
+
+    def read_script(self, name):
+        """Statements of the unpacked script, data file paths are moved to the local `secure_file_priv`."""
+        with open(self.SecureFilePriv / name) as file:
+            script = ''.join(line for line in file if not line.lstrip().startswith('#'))
+        statements = [statement.strip() for statement in re.split(r';[ \t]*(?:\n|$)', script)]
+        return [self.relocate(statement) for statement in statements if statement]
+
+    def relocate(self, script):
+        """Moves paths of LOAD DATA to the local `secure_file_priv`."""
+        return re.sub(r"INFILE '[^']*?([^'/]+/[^'/]+)'", lambda match: f"INFILE '{self.SecureFilePriv / match.group(1)}'", script)
+
+    def extract_table(self, archive, table):
+        """Extracts data files and the script of one table, only their members of an `--indexed` archive are read."""
+        archive = Path(archive)
+        db_name, _, table_name = table.partition('.')
+        if not table_name:
+            die("--table expects <database>.<table>")
+        index_path = IndexedArchiveWriter.index_path(archive)
+        if not index_path.is_file():
+            die(f"Index {index_path} does not exist, the archive was not made with --indexed")
+        with open(index_path) as file:
+            index = json.load(file)['files']
+        pattern = re.compile(rf'{re.escape(db_name)}/{re.escape(table_name)}(\.[^./]+)?\.(data|csv|sql)')
+        members = [name for name in index if pattern.fullmatch(name)]
+        if not members:
+            die(f"Table `{db_name}`.`{table_name}` is not in {archive}")
+        start_time = time.time()
+        # the server only reads the files, the folder is not handed over to `mysql` as for an export
+        (self.SecureFilePriv / db_name).mkdir(parents=True, exist_ok=True)
+        compressor = compressor_for(archive.name)
+        names = []
+        for name in members:
+            self.unpack_archive(archive, compressor, names, index[name]['offset'], index[name]['length'])
+        manifest_path = Manifest.file_path(archive.parent, db_name)
+        if manifest_path.is_file():
+            manifest = Manifest.load(manifest_path, db_name)
+            if manifest:
+                self.unpack_data_files(manifest, names, [table_name])
+        chunk_list = DedupStore.file_path(archive.parent, db_name)
+        if chunk_list.is_file():
+            self.assemble_data_files(chunk_list, names, pattern)
+        script = self.SecureFilePriv / db_name / f'{table_name}.sql'
+        script.write_text(self.relocate(script.read_text()))
+        print(f"Extracted `{db_name}`.`{table_name}` in {time.time() - start_time:.2f}s: {', '.join(names)}")
+        print(f"Restore the table with: mysql -D {db_name} < {script}")
+
+    def load_file_size(self, statement):
+        match = re.search(r"INFILE '([^']+)'", statement)
+        return os.path.getsize(match.group(1)) if match and os.path.exists(match.group(1)) else 0
+
+    def run_statements(self, statements, cursor=None):
+        for statement in statements:
+            self.sql(statement, cursor)
+
+    def run_parallel(self, groups, session_sql=(), final_sql=()):
+        """Runs groups of statements over `jobs` connections, statements of one group run in order on one connection."""
+        if not groups:
+            return
+        workers = queue.Queue()
+        try:
+            for _ in range(min(self.jobs, len(groups))):
+                conn, cursor = self.connect_worker()
+                workers.put((conn, cursor))
+                conn.autocommit = True
+                self.run_statements(session_sql, cursor)
+            with ThreadPoolExecutor(max_workers=workers.qsize()) as pool:
+                self.wait_all([pool.submit(self.statements_with_worker, workers, group) for group in groups])
+            for _, cursor in list(workers.queue):
+                self.run_statements(final_sql, cursor)
+        finally:
+            self.close_workers(workers)
+
+    def statements_with_worker(self, workers, statements):
+        conn, cursor = workers.get()
+        try:
+            self.run_statements(statements, cursor)
+        finally:
+            workers.put((conn, cursor))
+
+
+class InstanceLogFilter(logging.Filter):
+    """Prefixes the messages logged by the thread of an instance with its name."""
+
+    def __init__(self):
+        super().__init__()
+        self.names = {}
+
+    def filter(self, record):
+        name = self.names.get(record.thread)
+        if name:
+            record.msg = f'[{name}] {record.msg}'
+        return True
+
+
+class Instances:
+    """Backs up the MySQL instances of the `[instance:<name>]` sections of the config in one process.
+
+    At most `parallel_instances` databases are exported at once and the instances take turns database by database.
+    `compress_rate` of `[backup]` is shared by all instances, an instance with its own `compress_rate` has its own limit.
+    Metrics of all instances are saved as one report.
+    """
+
+    def __init__(self, names, **kwargs):
+        self.names = names
+        self.kwargs = kwargs
+        self.defaults = Backup(**kwargs, shared=True)
+        self.slots = FairSlots(self.defaults.parallel_instances)
+        self.metrics = {}
+        self.errors = {}
+        self.log_filter = InstanceLogFilter()
+
+    @staticmethod
+    def configured(config_path=None):
+        config = configparser.ConfigParser()
+        config.read(Path(config_path or Backup.mysql_config_file))
+        return [section.split(':', 1)[1] for section in config.sections() if section.startswith('instance:')]
+
+    def run(self):
+        backups = {name: Backup(**self.kwargs, instance=name) for name in self.names}
+        for title, folder in (('backup folder', lambda b: b.output or b.path or b.backup_dir), ('secure_file_priv', lambda b: b.SecureFilePriv)):
+            folders = [folder(backup) for backup in backups.values()]
+            shared = sorted({str(path) for path in folders if folders.count(path) > 1})
+            if shared:
+                die(f"Instances must not share the {title}: {', '.join(shared)}")
+        shared_limiter = self.defaults.compressor.limiter
+        for backup in backups.values():
+            backup.slots = self.slots
+            if shared_limiter and backup.compressor.limiter and backup.compressor.limiter.rate == shared_limiter.rate:
+                backup.compressor.limiter = shared_limiter
+            # one report is saved for the whole run
+            backup.metrics_file = backup.metrics_textfile = None
+        logging.getLogger().addFilter(self.log_filter)
+        try:
+            threads = [threading.Thread(target=self.backup_instance, args=(name, backup), name=f'instance-{name}')
+                       for name, backup in backups.items()]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            logging.getLogger().removeFilter(self.log_filter)
+        self.report()
+        if not self.defaults.dry_run:
+            self.save_metrics()
+        if self.errors:
+            die(f"Backup of instances failed: {', '.join(sorted(self.errors))}")
+
+    def backup_instance(self, name, backup):
+        self.log_filter.names[threading.get_ident()] = name
+        try:
+            with backup:
+                backup.process()
+        except Exception as error:
+            logging.error(f"Backup failed: {error}")
+            self.errors[name] = str(error)
+        finally:
+            self.metrics[name] = backup.metrics
+
+    def report(self):
+        for name in self.names:
+            report = self.metrics[name].report(name not in self.errors)
+            databases = report['databases'].values()
+            size = sum(database['bytes'] for database in databases) / 1024 ** 2
+            archives = sum(database['archive_bytes'] for database in databases) / 1024 ** 2
+            status = f"failed: {self.errors[name]}" if name in self.errors else 'ok'
+            logging.info(f"Instance {name}: {status}, {len(report['databases'])} databases, "
+                         f"{size:.1f} MB -> {archives:.1f} MB in {report['duration']:.2f}s")
+
+    def save_metrics(self):
+        runs = {name: (self.metrics[name], name not in self.errors) for name in self.names}
+        try:
+            if self.defaults.metrics_file:
+                report = self.defaults.metrics.report(not self.errors)
+                report['instances'] = {name: metrics.report(success) for name, (metrics, success) in runs.items()}
+                Metrics.save(self.defaults.metrics_file, json.dumps(report, indent=2, sort_keys=True))
+            if self.defaults.metrics_textfile:
+                # Prometheus sets `instance` to the scraped target, its own label would be renamed to `exported_instance`
+                Metrics.write_textfile(self.defaults.metrics_textfile,
+                                       [metrics.samples(success, mysql_instance=name) for name, (metrics, success) in runs.items()])
+        except OSError as e:
+            logging.warning(f"Can not save metrics: {e}")
 
 
 def configure_logging(log_level=logging.INFO, log_file='/var/log/backup.log'):
@@ -523,13 +3270,42 @@ def main():
     parser.add_argument("-s", "--save", help="Path where backups would be saved, default '/srv/backups'", default=None)
     parser.add_argument("-oft", "--one-file-per-table", help="make sql import file for each table", action="store_true")
     parser.add_argument("-nli", "--no-lazy-index", help="Keeps table schema and indexes creation together", action="store_true")
+    parser.add_argument("--inplace", help="Build indexes on import with ALGORITHM=INPLACE", action="store_true")
     parser.add_argument("--engine", help="Replace ENGINE in output sql file", default=None)
     parser.add_argument("--ignore", help="Ignore databases. Example: 'tmp,test*'", default=None)
     parser.add_argument("--rocksdb", help="Export for RocksDB engine", action="store_true")
     parser.add_argument("-e", "--exclude", help="Ignore tables matching the mask. Example: '^test_|_$'", default=None)
     parser.add_argument("-i", "--include", help="Only tables matching the mask. Example: '^account_|_user$'", default=None)
     parser.add_argument("-o", "--output", help="Specify output file name", default=None)
-    parser.add_argument("-f", "--fast", help="For fast import: creates four sql files structure, load, index, analyze", action="store_true")
+    parser.add_argument("-f", "--fast", help="For fast import: creates five sql files structure, load, index, analyze, foreign keys", action="store_true")
+    parser.add_argument("-j", "--jobs", help="Number of connections exporting tables in parallel", type=int, default=None)
+    parser.add_argument("--chunk-rows", help="Split tables into primary key ranges of about this many rows", type=int, default=None)
+    parser.add_argument("--chunk-size", help="Split tables into primary key ranges of about this size. Example: 1G", type=parse_size, default=None)
+    parser.add_argument("-p", "--pipeline", help="Compress a database while the next one is exported", action="store_true")
+    parser.add_argument("--max-staged", help="Pipeline: max databases waiting uncompressed in secure_file_priv, default 2", type=int, default=None)
+    parser.add_argument("--stream", help="Move every data file into the archive as soon as it is exported", action="store_true")
+    parser.add_argument("--incremental", help="Hard link data of the tables unchanged since the previous backup", action="store_true")
+    parser.add_argument("--dedup", help="Store data files as chunks shared by all backups in backup_dir, only changed chunks are written", action="store_true")
+    parser.add_argument("--client-export", help="Read the rows over the connection instead of SELECT ... INTO OUTFILE, for backups from another host", action="store_true")
+    parser.add_argument("--resume", help="Retry or rerun after a crash keeps tables finished earlier, they come from an earlier snapshot", action="store_true")
+    parser.add_argument("--compressor", help="Archive compression: gzip (default), pgzip, zstd, none", choices=list(COMPRESSORS), default=None)
+    parser.add_argument("--compress-level", help="Compression level, default 6 for gzip and 3 for zstd", type=int, default=None)
+    parser.add_argument("--compress-threads", help="Threads used by pgzip and zstd, default number of CPUs", type=int, default=None)
+    parser.add_argument("--restore", help="Restore the database from the archive, --jobs connections load the data", default=None)
+    parser.add_argument("--max-threads-running", help="Fewer export workers while Threads_running of the server is above it", type=int, default=None)
+    parser.add_argument("--max-replica-lag", help="Fewer export workers while the replica lags more seconds", type=int, default=None)
+    parser.add_argument("--compress-rate", help="Max bytes per second fed to the compressor. Example: 50M", type=parse_size, default=None)
+    parser.add_argument("--metrics", help="Save durations, bytes and rows of the run as JSON to the file", default=None)
+    parser.add_argument("--metrics-textfile", help="Save the metrics in Prometheus text format to the file", default=None)
+    parser.add_argument("--indexed", help="Compress every file of the archive on its own and save an index, for --extract", action="store_true")
+    parser.add_argument("--extract", help="Extract one table given by --table from the --indexed archive", default=None)
+    parser.add_argument("--table", help="Table to extract: <database>.<table>", default=None)
+    parser.add_argument("--table-checksums", help="Save CHECKSUM TABLE read in the snapshot, --restore compares the restored tables with it", action="store_true")
+    parser.add_argument("--verify", help="Check the archive and the data files of the backup against the checksums saved in it", default=None)
+    parser.add_argument("--rows", help="Verify: also count the rows of the data files and compare with the rows exported", action="store_true")
+    parser.add_argument("--instance", help="Instances of the config to back up split by ','; one for --restore, --verify and --extract", default=None)
+    parser.add_argument("--min-free", help="Free space kept on the staging and backup disks, exports pause below it, default 1G", type=parse_size, default=None)
+    parser.add_argument("--parallel-instances", help="Databases of different instances exported at once, default 2", type=int, default=None)
     parser.add_argument("-n", "--dry-run", help="Just show the databases that will be backed up", action="store_true")
     parser.add_argument("--csv", help="Use csv format", action="store_true")
     parser.add_argument("--debug", help="Debug mode", action="store_true")
@@ -539,27 +3315,73 @@ def main():
         'as_csv': args.csv,
         'debug': args.debug,
         'rocksdb': args.rocksdb,
-        'config_file': args.config,
+        'config': args.config,
         'db_names': args.databases,
         'save': args.save,
         'log': args.log,
         'engine': args.engine,
         'oft': args.one_file_per_table,
         'nli': args.no_lazy_index,
+        'inplace': args.inplace,
         'ignore': args.ignore,
         'include': args.include,
         'exclude': args.exclude,
         'fast': args.fast,
         'dry_run': args.dry_run,
+        'jobs': args.jobs,
+        'chunk_rows': args.chunk_rows,
+        'chunk_size': args.chunk_size,
+        'pipeline': args.pipeline,
+        'max_staged': args.max_staged,
+        'stream': args.stream,
+        'incremental': args.incremental,
+        'dedup': args.dedup,
+        'table_checksums': args.table_checksums,
+        'resume': args.resume,
+        'client_export': args.client_export,
+        'indexed': args.indexed,
+        'metrics': args.metrics,
+        'metrics_textfile': args.metrics_textfile,
+        'compression': args.compressor,
+        'compress_level': args.compress_level,
+        'compress_threads': args.compress_threads,
+        'compress_rate': args.compress_rate,
+        'max_threads_running': args.max_threads_running,
+        'max_replica_lag': args.max_replica_lag,
         'output': args.output,
+        'parallel_instances': args.parallel_instances,
+        'min_free': args.min_free,
     }
     log_level = logging.DEBUG if args.debug else logging.INFO
     configure_logging(log_level, log_file=args.log)
     if args.one_file_per_table and args.fast:
         die("--one-file-per-table and --fast can`t be combined")
+    instances = Instances.configured(args.config)
+    if instances and not (args.extract or args.restore or args.verify):
+        Instances(args.instance.split(',') if args.instance else instances, **kwargs).run()
+        return
+    if instances:
+        if not args.instance or ',' in args.instance:
+            die(f"Choose one of the instances with --instance: {', '.join(instances)}")
+        kwargs['instance'] = args.instance
+    elif args.instance:
+        die("There are no [instance:<name>] sections in the config")
+    if args.verify:
+        # the archive is checked against its own checksums, no server is needed, also not for --rows
+        Backup(**kwargs).verify(args.verify, args.rows)
+        return
+    if args.extract:
+        # the table is read from the local archive with its index, the server is only needed to load it afterwards
+        if not args.table:
+            die("--extract requires --table <database>.<table>")
+        Backup(**kwargs).extract_table(args.extract, args.table)
+        return
     with Backup(**kwargs) as backup:
         try:
-            backup.process()
+            if args.restore:
+                backup.restore(args.restore)
+            else:
+                backup.process()
         except mysql.connector.Error as err:
             if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
                 die("Something is wrong with your user name or password")
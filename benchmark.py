@@ -0,0 +1,303 @@
+#!/usr/bin/python3
+"""Benchmark of backup.py against a stand-in of the MySQL server, no server is needed.
+
+The stand-in answers the queries of the backup from a synthetic schema and writes `SELECT ... INTO OUTFILE`
+files of the requested size, so the results measure the script and the compressor, not the server.
+"""
+from pathlib import Path
+import argparse
+import json
+import logging
+import random
+import re
+import resource
+import shutil
+import string
+import tempfile
+import time
+
+from backup import Backup, COMPRESSORS, parse_size
+
+
+class Schema:
+    """Databases of `tables` tables each, `size` bytes of data are shared by the tables as 1, 1/2, 1/3 ... of the largest."""
+
+    def __init__(self, databases=2, tables=50, size=256 * 1024 ** 2, columns=8, indexes=2, foreign_keys=1, seed=1):
+        self.columns = columns
+        self.indexes = min(indexes, columns)
+        self.foreign_keys = foreign_keys
+        self.random = random.Random(seed)
+        self.databases = {f'bench{db:02d}': [f't{table:05d}' for table in range(tables)] for db in range(databases)}
+        weights = [1 / (table + 1) for table in range(tables)]
+        share = size / databases / sum(weights)
+        self.sizes = {(db_name, table_name): int(share * weight)
+                      for db_name, table_names in self.databases.items() for table_name, weight in zip(table_names, weights)}
+        self.pool = self.rows()
+        self.pool_rows = self.pool.count(b'\n')
+        self.row_length = len(self.pool) // self.pool_rows
+
+    def rows(self, size=4 * 1024 ** 2):
+        """A block of rows in the format of SELECT ... INTO OUTFILE, the data files are cut from it."""
+        rows = []
+        length = 0
+        while length < size:
+            fields = [str(len(rows) + 1)]
+            for column in range(1, self.columns + 1):
+                if column % 2:
+                    words = (''.join(self.random.choices(string.ascii_lowercase, k=self.random.randint(3, 9))) for _ in range(3))
+                    fields.append(' '.join(words))
+                else:
+                    fields.append(str(self.random.randint(0, 10 ** 6)))
+            row = ('\t'.join(fields) + '\n').encode()
+            rows.append(row)
+            length += len(row)
+        return b''.join(rows)
+
+    def create_table(self, table_name, index=0):
+        lines = ['  `id` bigint NOT NULL AUTO_INCREMENT']
+        for column in range(1, self.columns + 1):
+            lines.append(f'  `c{column}` varchar(64) DEFAULT NULL' if column % 2 else f'  `c{column}` int DEFAULT NULL')
+        lines.append('  PRIMARY KEY (`id`)')
+        lines += [f'  KEY `k{column}` (`c{column}`)' for column in range(1, self.indexes + 1)]
+        if index:
+            lines += [f'  CONSTRAINT `{table_name}_fk{key}` FOREIGN KEY (`c{2 * key}`) REFERENCES `t{index - 1:05d}` (`id`)'
+                      for key in range(1, min(self.foreign_keys, self.columns // 2) + 1)]
+        auto_increment = f' AUTO_INCREMENT={index + 1}' if index else ''
+        return (f'CREATE TABLE `{table_name}` (\n' + ',\n'.join(lines) +
+                f'\n) ENGINE=InnoDB{auto_increment} DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci')
+
+    def write(self, path, size):
+        """Writes about `size` bytes of whole rows to `path`, returns the number of rows."""
+        rows = 0
+        with open(path, 'wb') as file:
+            while size >= len(self.pool):
+                file.write(self.pool)
+                size -= len(self.pool)
+                rows += self.pool_rows
+            end = self.pool.rfind(b'\n', 0, size) + 1
+            file.write(self.pool[:end])
+            rows += self.pool.count(b'\n', 0, end)
+        return rows
+
+
+class Cursor:
+    """Cursor of the stand-in, a query the backup is not expected to send fails with NotImplementedError."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.schema = connection.schema
+        self.result = []
+        self.rowcount = -1
+
+    def execute(self, query, params=None):
+        query = ' '.join(query.split())
+        self.result = []
+        self.rowcount = -1
+        if re.match(r'(SET|START TRANSACTION|COMMIT|ROLLBACK|FLUSH|UNLOCK)\b', query):
+            return
+        if query == "SHOW VARIABLES like 'secure_file_priv'":
+            self.result = [('secure_file_priv', str(self.connection.secure_file_priv))]
+        elif query == 'SHOW DATABASES':
+            self.result = [(db_name,) for db_name in ['information_schema', 'mysql', *self.schema.databases]]
+        elif match := re.match(r"SELECT TABLE_SCHEMA, TABLE_NAME, ENGINE, .* WHERE TABLE_SCHEMA IN \((.*?)\)", query):
+            self.result = [
+                (db_name, table_name, 'InnoDB', size // self.schema.row_length, self.schema.row_length, size, size // 4, None, '')
+                for db_name in re.findall(r"'(\w+)'", match.group(1)) for table_name in self.schema.databases[db_name]
+                for size in [self.schema.sizes[db_name, table_name]]
+            ]
+        elif query.startswith('SELECT TABLE_SCHEMA, TABLE_NAME, PARTITION_NAME'):
+            self.result = []
+        elif match := re.match(r"SELECT k.TABLE_SCHEMA, .* WHERE k.TABLE_SCHEMA IN \((.*?)\)", query):
+            self.result = [(db_name, table_name, 'id', 'bigint')
+                           for db_name in re.findall(r"'(\w+)'", match.group(1)) for table_name in self.schema.databases[db_name]]
+        elif match := re.match(r'SHOW CREATE TABLE `(\w+)`.`(\w+)`', query):
+            table_name = match.group(2)
+            self.result = [(table_name, self.schema.create_table(table_name, self.schema.databases[match.group(1)].index(table_name)))]
+        elif match := re.match(r"SELECT MIN\((.+?)\), MAX\(.+?\) FROM `(\w+)`.`(\w+)`", query):
+            rows = self.schema.sizes[match.group(2), match.group(3)] // self.schema.row_length
+            self.result = [(1, rows) if rows else (None, None)]
+        elif match := re.match(r"SELECT \* INTO OUTFILE '([^']+)' .*FROM `(\w+)`.`(\w+)`(?: WHERE (.*?))?(?: ORDER BY .*)?$", query):
+            path, db_name, table_name, condition = match.groups()
+            size = self.schema.sizes[db_name, table_name]
+            if condition:
+                # chunks of a table split by the primary key have an equal share of its rows
+                rows = max(size // self.schema.row_length, 1)
+                bounds = sorted({int(value) for value in re.findall(r'[<>]=? (\d+)', condition)})
+                low = bounds[0] if '>=' in condition else 1
+                high = bounds[-1] if '<' in condition else rows + 1
+                size = size * max(high - low, 0) // rows
+            self.rowcount = self.schema.write(path, size)
+        elif match := re.match(r'CHECKSUM TABLE `(\w+)`.`(\w+)`', query):
+            self.result = [(f'{match.group(1)}.{match.group(2)}', self.schema.sizes[match.group(1), match.group(2)])]
+        else:
+            raise NotImplementedError(f'The benchmark server does not answer: {query}')
+
+    def fetchone(self):
+        return self.result.pop(0) if self.result else None
+
+    def fetchall(self):
+        result, self.result = self.result, []
+        return result
+
+    def close(self):
+        pass
+
+
+class Connection:
+    def __init__(self, schema, secure_file_priv):
+        self.schema = schema
+        self.secure_file_priv = secure_file_priv
+
+    def cursor(self, **kwargs):
+        return Cursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BenchmarkBackup(Backup):
+    """Backup connected to the stand-in, the files are written by the user running the benchmark instead of `mysql`."""
+    interactive = False
+
+    def __init__(self, schema, **kwargs):
+        self.schema = schema
+        super().__init__(**kwargs)
+
+    def connect(self):
+        return Connection(self.schema, self.SecureFilePriv)
+
+    def connect_to_database(self):
+        self.conn = self.connect()
+        self.cursor = self.conn.cursor()
+        self.configure_session()
+
+    def reconnect(self, attempt=0):
+        self.connect_to_database()
+
+    def connect_worker(self):
+        conn = self.connect()
+        cursor = conn.cursor()
+        self.configure_session(cursor)
+        return conn, cursor
+
+    def output_folder(self, db_name):
+        folder = self.SecureFilePriv / db_name
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder
+
+
+def peak_rss():
+    """Peak resident memory in MB of the benchmark and of its largest child process (gzip, zstd), as counted by the kernel."""
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+
+
+def rate(amount, seconds):
+    return round(amount / seconds, 1) if seconds else None
+
+
+def bench_ddl(schema, count):
+    """Tables per second of `separate_structure_and_indexes` on the DDL of the schema."""
+    statements = [schema.create_table(f't{index:05d}', index) for index in range(min(count, 1000))]
+    start = time.perf_counter()
+    for index in range(count):
+        Backup.separate_structure_and_indexes(statements[index % len(statements)])
+    seconds = time.perf_counter() - start
+    return {'tables': count, 'seconds': round(seconds, 3), 'tables_per_second': rate(count, seconds)}
+
+
+def bench_metadata(schema, kwargs):
+    """Tables per second of the metadata queries and of reading and splitting the DDL of every table."""
+    with BenchmarkBackup(schema, **kwargs) as backup:
+        start = time.perf_counter()
+        backup.load_metadata(list(schema.databases))
+        for db_name in schema.databases:
+            backup.get_tables_structures(db_name, backup.get_tables(db_name), False)
+        seconds = time.perf_counter() - start
+    count = sum(len(table_names) for table_names in schema.databases.values())
+    return {'tables': count, 'seconds': round(seconds, 3), 'tables_per_second': rate(count, seconds)}
+
+
+def bench_process(schema, kwargs):
+    """Full backup run: export and compression throughput from the metrics of the run."""
+    with BenchmarkBackup(schema, **kwargs) as backup:
+        start = time.perf_counter()
+        backup.process()
+        seconds = time.perf_counter() - start
+        databases = backup.metrics.report(True)['databases'].values()
+    exported = sum(database['bytes'] for database in databases) / 1024 ** 2
+    archived = sum(database['archive_bytes'] for database in databases) / 1024 ** 2
+    export = sum(database['phases'].get('export', 0) for database in databases)
+    compression = sum(database['phases'].get('compression', 0) for database in databases)
+    return {
+        'seconds': round(seconds, 3), 'exported_mb': round(exported, 1), 'archive_mb': round(archived, 1),
+        'export_mb_per_second': rate(exported, export),
+        'compression_mb_per_second': rate(exported, compression),
+        'total_mb_per_second': rate(exported, seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark backup.py against a stand-in of the MySQL server")
+    parser.add_argument("--databases", help="Number of databases, default 2", type=int, default=2)
+    parser.add_argument("--tables", help="Tables per database, default 50", type=int, default=50)
+    parser.add_argument("--size", help="Data of all tables, default 256M", type=parse_size, default='256M')
+    parser.add_argument("--columns", help="Columns besides the primary key, default 8", type=int, default=8)
+    parser.add_argument("--indexes", help="Secondary indexes per table, default 2", type=int, default=2)
+    parser.add_argument("--foreign-keys", help="Foreign keys per table, default 1", type=int, default=1)
+    parser.add_argument("--ddl-tables", help="CREATE TABLE statements split by the DDL benchmark, default 20000", type=int, default=20000)
+    parser.add_argument("--only", help="Run some of the benchmarks split by ',': ddl, metadata, process", default='ddl,metadata,process')
+    parser.add_argument("-j", "--jobs", help="Export connections, default 1", type=int, default=None)
+    parser.add_argument("--chunk-size", help="Split tables into primary key ranges of about this size", type=parse_size, default=None)
+    parser.add_argument("--compressor", help="gzip (default), pgzip, zstd, none", choices=list(COMPRESSORS), default=None)
+    parser.add_argument("--compress-level", help="Compression level", type=int, default=None)
+    parser.add_argument("-p", "--pipeline", help="Compress a database while the next one is exported", action="store_true")
+    parser.add_argument("--stream", help="Move every data file into the archive as soon as it is exported", action="store_true")
+    parser.add_argument("-f", "--fast", help="Five sql files for fast import", action="store_true")
+    parser.add_argument("--dir", help="Folder for the staging and backup folders, default a temporary folder", default=None)
+    parser.add_argument("--json", help="Save the results as JSON to the file, to compare runs", default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(message)s')
+    schema = Schema(args.databases, args.tables, args.size, args.columns, args.indexes, args.foreign_keys)
+    folder = Path(tempfile.mkdtemp(prefix='mysql-backup-bench-', dir=args.dir))
+    try:
+        (folder / 'files').mkdir()
+        (folder / 'backups').mkdir()
+        config = folder / 'bench.cnf'
+        config.write_text(f"[client]\nuser=bench\n[backup]\nsecure_file_priv={folder / 'files'}\npath={folder / 'backups'}\n")
+        kwargs = {
+            'config': config, 'jobs': args.jobs, 'chunk_size': args.chunk_size, 'compression': args.compressor,
+            'compress_level': args.compress_level, 'pipeline': args.pipeline, 'stream': args.stream, 'fast': args.fast,
+            'min_free': 0,
+        }
+        only = args.only.split(',')
+        results = {'settings': {key: value for key, value in vars(args).items() if key not in ('json', 'dir', 'only')}}
+        if 'ddl' in only:
+            results['ddl'] = bench_ddl(schema, args.ddl_tables)
+        if 'metadata' in only:
+            results['metadata'] = bench_metadata(schema, kwargs)
+        if 'process' in only:
+            results['process'] = bench_process(schema, kwargs)
+        results['peak_rss_mb'], results['peak_child_rss_mb'] = (round(value, 1) for value in peak_rss())
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    for name in ('ddl', 'metadata'):
+        if name in results:
+            print(f"{name:<12}{results[name]['tables']:>8} tables {results[name]['seconds']:>9.3f}s "
+                  f"{results[name]['tables_per_second']:>12.1f} tables/s")
+    if 'process' in results:
+        process = results['process']
+        print(f"{'process':<12}{process['exported_mb']:>8.1f} MB {process['seconds']:>13.3f}s, archives {process['archive_mb']:.1f} MB")
+        for key in ('export', 'compression', 'total'):
+            print(f"{'':<12}{key:<12}{process[f'{key}_mb_per_second'] or 0:>12.1f} MB/s")
+    print(f"{'peak RSS':<12}{results['peak_rss_mb']:>8.1f} MB, largest child process {results['peak_child_rss_mb']:.1f} MB")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
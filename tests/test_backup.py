@@ -0,0 +1,299 @@
+from decimal import Decimal
+import hashlib
+import json
+import os
+from pathlib import Path
+import sys
+import tarfile
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import backup  # noqa: E402
+
+
+class DataDirectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = Path(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_write_does_not_change_linked_file_of_previous_backup(self):
+        previous = backup.DataDirectory(self.root / '20260101', backup.NoCompressor())
+        previous.write('shop/orders.data', [b'1\told\n'])
+        current = backup.DataDirectory(self.root / 'day3', backup.NoCompressor())
+        # a retry with --resume exports again the table the failed attempt has linked
+        current.link(self.root / '20260101' / 'shop' / 'orders.data', 'shop/orders.data')
+        current.write('shop/orders.data', [b'1\tnew\n', b'2\tnew\n'])
+        self.assertEqual((self.root / '20260101' / 'shop' / 'orders.data').read_bytes(), b'1\told\n')
+        self.assertEqual((self.root / 'day3' / 'shop' / 'orders.data').read_bytes(), b'1\tnew\n2\tnew\n')
+        self.assertEqual([path.name for path in (self.root / 'day3' / 'shop').iterdir()], ['orders.data'])
+
+
+class IndexedArchiveWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = Path(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_gzip_members_are_written_without_gzip_processes(self):
+        (self.root / 'shop').mkdir()
+        (self.root / 'shop' / 'orders.data').write_bytes(b'1\tbook\n' * 1000)
+        (self.root / 'shop' / 'orders.sql').write_text('SELECT 1;\n')
+        archive_path = self.root / 'shop.tgz'
+        with mock.patch('subprocess.Popen', side_effect=AssertionError('gzip process started')):
+            writer = backup.IndexedArchiveWriter(archive_path, backup.Compressor())
+            writer.add(self.root / 'shop', 'shop')
+            writer.close()
+        with tarfile.open(archive_path) as tar:
+            self.assertEqual(tar.extractfile('shop/orders.data').read(), b'1\tbook\n' * 1000)
+        member = json.loads(writer.index_path(archive_path).read_text())['files']['shop/orders.sql']
+        reader = backup.Compressor().open_reader(archive_path, member['offset'], member['length'])
+        with tarfile.open(fileobj=reader, mode='r|') as tar:
+            info = tar.next()
+            self.assertEqual((info.name, tar.extractfile(info).read()), ('shop/orders.sql', b'SELECT 1;\n'))
+
+
+class DedupStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = Path(self.folder.name)
+        self.data_file = self.root / 'orders.data'
+        self.data_file.write_bytes(b'1\tbook\n')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def store(self, day):
+        store = backup.DedupStore(self.root / 'chunks', 'shop', self.root / day)
+        (self.root / day).mkdir(exist_ok=True)
+        store.add(self.data_file, 'shop/orders.data')
+        store.save()
+        return store
+
+    def chunk(self, data, age):
+        digest = hashlib.sha256(data).hexdigest()
+        path = backup.DedupStore.chunk_path(self.root / 'chunks', digest, False)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def age(self, seconds):
+        for path in (self.root / 'chunks').glob('*/*'):
+            os.utime(path, (time.time() - seconds, time.time() - seconds))
+
+    def test_referenced_chunk_survives(self):
+        self.store('day1')
+        self.age(3600)
+        unreferenced = self.chunk(b'2\tpen\n', 3600)
+        backup.DedupStore.collect_garbage(self.root, time.time())
+        self.assertEqual([path.name for path in (self.root / 'chunks').glob('*/*')],
+                         [hashlib.sha256(b'1\tbook\n').hexdigest()])
+        self.assertFalse(unreferenced.exists())
+
+    def test_chunk_touched_after_start_survives(self):
+        started = time.time() - 60
+        recent = self.chunk(b'2\tpen\n', 0)
+        old = self.chunk(b'3\tink\n', 3600)
+        backup.DedupStore.collect_garbage(self.root, started)
+        self.assertTrue(recent.exists())
+        self.assertFalse(old.exists())
+
+    def test_unreadable_chunk_list_stops_collection(self):
+        self.store('day1')
+        (self.root / 'day2').mkdir()
+        backup.DedupStore.file_path(self.root / 'day2', 'shop').write_text('{"files": ')
+        unreferenced = self.chunk(b'2\tpen\n', 3600)
+        backup.DedupStore.collect_garbage(self.root, time.time())
+        self.assertTrue(unreferenced.exists())
+
+    def test_inserted_line_changes_only_neighbouring_chunks(self):
+        lines = [f'{row}\tname{row}\n'.encode() for row in range(20000)]
+        with mock.patch.multiple(backup.DedupStore, min_size=1024, max_size=64 * 1024, threshold=2 ** 32 // 64):
+            before = list(backup.DedupStore.split(lines))
+            after = list(backup.DedupStore.split(lines[:10000] + [b'10000.5\tinserted\n'] + lines[10000:]))
+        self.assertGreater(len(before), 20)
+        self.assertEqual(b''.join(before), b''.join(lines))
+        prefix = next(i for i, (old, new) in enumerate(zip(before, after)) if old != new)
+        suffix = next(i for i, (old, new) in enumerate(zip(reversed(before), reversed(after))) if old != new)
+        self.assertLessEqual(len(before) - prefix - suffix, 2)
+        self.assertLessEqual(len(after) - prefix - suffix, 2)
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = Path(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_resume_skips_unchanged_files_and_torn_line(self):
+        data_file = self.root / 'orders.txt'
+        data_file.write_bytes(b'1\n2\n')
+        checkpoint = backup.Checkpoint(self.root / 'shop.checkpoint.jsonl')
+        checkpoint.structures = {'orders': 'ddl1'}
+        checkpoint.add(data_file, 'orders', 'id < 10', {'rows': 2})
+        with open(checkpoint.path, 'a') as file:
+            file.write('{"file": "items.t')
+        resumed = backup.Checkpoint.load(checkpoint.path, 3600)
+        resumed.structures = {'orders': 'ddl1'}
+        self.assertTrue(resumed.done(data_file, 'orders', 'id < 10'))
+        self.assertFalse(resumed.done(data_file, 'orders', 'id >= 10'))
+        self.assertEqual(resumed.files[str(data_file)]['checksums'], {'rows': 2})
+        data_file.write_bytes(b'1\n')
+        self.assertFalse(resumed.done(data_file, 'orders', 'id < 10'))
+
+    def test_table_altered_since_the_file_was_exported(self):
+        data_file = self.root / 'orders.txt'
+        data_file.write_bytes(b'1\n')
+        checkpoint = backup.Checkpoint(self.root / 'shop.checkpoint.jsonl')
+        checkpoint.structures = {'orders': 'ddl1'}
+        checkpoint.add(data_file, 'orders', None)
+        resumed = backup.Checkpoint.load(checkpoint.path, 3600)
+        resumed.structures = {'orders': 'ddl2'}
+        self.assertFalse(resumed.done(data_file, 'orders', None))
+
+
+class InstancesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.config = Path(self.folder.name) / 'backup.cnf'
+        readme = (Path(__file__).resolve().parent.parent / 'README.rst').read_text()
+        block = readme.split('Several instances', 1)[1].split('.. code-block:: none', 1)[1].split('\nbackup_dir\n', 1)[0]
+        self.config.write_text('\n'.join(line[4:] for line in block.splitlines()))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_readme_config_without_client_section(self):
+        self.assertEqual(backup.Instances.configured(self.config), ['main', 'stats'])
+        instances = backup.Instances(['main', 'stats'], config=self.config, dry_run=True)
+        self.assertEqual(instances.defaults.parallel_instances, 2)
+        self.assertEqual(instances.defaults.compressor.limiter.rate, 200 * 1024 ** 2)
+        main = backup.Backup(config=self.config, instance='main')
+        self.assertEqual(main.db_config['unix_socket'], '/run/mysqld/main.sock')
+        self.assertEqual(main.SecureFilePriv, Path('/srv/main/files'))
+        with self.assertRaises(ValueError):
+            backup.Backup(config=self.config)
+
+
+class GetTableChunksTest(unittest.TestCase):
+    def chunks(self, low, high, rows=1000, primary_key=(('id', 'int'),), chunk_rows=100, chunk_size=None):
+        exporter = backup.Backup.__new__(backup.Backup)
+        exporter.chunk_rows = chunk_rows
+        exporter.chunk_size = chunk_size
+        exporter.metadata = {'shop': {'orders': {'rows': rows, 'avg_row_length': 100, 'partitions': [],
+                                                'primary_key': list(primary_key)}}}
+        exporter.cursor = mock.Mock()
+        exporter.cursor.fetchone.return_value = (low, high)
+        return exporter.get_table_chunks('shop', 'orders', ','.join(f'`{name}`' for name, _ in primary_key))
+
+    def assertCovers(self, chunks, low, high):
+        self.assertEqual([chunk for chunk, _ in chunks], list(range(1, len(chunks) + 1)))
+        for value in range(low - 100, high + 100):
+            matches = [chunk for chunk, condition in chunks
+                       if eval(condition.replace('`id`', str(value)).replace(' AND ', ' and '))]
+            self.assertEqual(len(matches), 1, f'id {value} is in chunks {matches}')
+
+    def test_ranges_cover_the_key_space_without_overlap(self):
+        chunks = self.chunks(1, 1000)
+        self.assertEqual(len(chunks), 10)
+        self.assertEqual((chunks[0][1], chunks[-1][1]), ('`id` < 101', '`id` >= 901'))
+        self.assertCovers(chunks, 1, 1000)
+
+    def test_range_narrower_than_the_chunk_count(self):
+        chunks = self.chunks(-5, 1)
+        self.assertEqual(len(chunks), 7)
+        self.assertCovers(chunks, -5, 1)
+
+    def test_chunk_size_limits_the_rows_of_a_chunk(self):
+        chunks = self.chunks(1, 10000, rows=10000, chunk_rows=None, chunk_size=100 * 2500)
+        self.assertEqual(len(chunks), 4)
+        self.assertCovers(chunks, 1, 10000)
+
+    def test_tables_exported_as_one_file(self):
+        self.assertEqual(self.chunks(7, 7), [(None, None)])
+        self.assertEqual(self.chunks(None, None), [(None, None)])
+        self.assertEqual(self.chunks(Decimal('1.5'), Decimal('900.5')), [(None, None)])
+        self.assertEqual(self.chunks(1, 1000, rows=100), [(None, None)])
+        self.assertEqual(self.chunks(1, 1000, primary_key=(('a', 'int'), ('b', 'int'))), [(None, None)])
+        self.assertEqual(self.chunks(1, 1000, primary_key=(('code', 'varchar'),)), [(None, None)])
+
+
+class SeparateStructureAndIndexesTest(unittest.TestCase):
+    orders = """CREATE TABLE `orders` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `name` varchar(64) DEFAULT NULL,
+  `val` int DEFAULT NULL,
+  `ref` int DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `name_idx` (`name`),
+  UNIQUE KEY `val_idx` (`val`),
+  KEY `ref_idx` (`ref`),
+  CONSTRAINT `fk_ref` FOREIGN KEY (`ref`) REFERENCES `users` (`id`)
+) ENGINE=InnoDB AUTO_INCREMENT=5 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci"""
+
+    def test_secondary_indexes_in_one_alter_with_algorithm(self):
+        structure, indexes, primary_key, foreign_keys = backup.Backup.separate_structure_and_indexes(self.orders, algorithm='INPLACE')
+        self.assertEqual(indexes, "ALTER TABLE `orders` ADD KEY `name_idx` (`name`), ADD UNIQUE KEY `val_idx` (`val`), "
+                                  "ADD KEY `ref_idx` (`ref`), ALGORITHM=INPLACE;")
+        self.assertEqual(primary_key, '`id`')
+        self.assertNotIn('KEY `', structure.replace('PRIMARY KEY', ''))
+        self.assertNotIn('AUTO_INCREMENT=5', structure)
+
+    def test_foreign_key_is_moved_out_of_create_table(self):
+        structure, _, _, foreign_keys = backup.Backup.separate_structure_and_indexes(self.orders)
+        self.assertEqual(structure, "CREATE TABLE `orders` (\n`id` int NOT NULL AUTO_INCREMENT,\n  `name` varchar(64) DEFAULT NULL,\n"
+                                    "  `val` int DEFAULT NULL,\n  `ref` int DEFAULT NULL,\n  PRIMARY KEY (`id`)\n) "
+                                    "ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci")
+        self.assertEqual(foreign_keys, "ALTER TABLE `orders` ADD CONSTRAINT `fk_ref` FOREIGN KEY (`ref`) REFERENCES `users` (`id`);")
+
+    def test_table_without_secondary_indexes(self):
+        create = "CREATE TABLE `log` (\n  `id` int NOT NULL,\n  `msg` text,\n  PRIMARY KEY (`id`)\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+        self.assertEqual(backup.Backup.separate_structure_and_indexes(create, algorithm='INPLACE'), (
+            "CREATE TABLE `log` (\n`id` int NOT NULL,\n  `msg` text,\n  PRIMARY KEY (`id`)\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4",
+            '', '`id`', None
+        ))
+
+    def test_rocksdb_partitioned_table_keeps_indexes_and_returns_foreign_keys(self):
+        create = ("CREATE TABLE `events` (\n  `id` int NOT NULL,\n  `ref` int DEFAULT NULL,\n  KEY `ref_idx` (`ref`),\n"
+                  "  CONSTRAINT `fk_ref` FOREIGN KEY (`ref`) REFERENCES `users` (`id`)\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4\n"
+                  "/*!50100 PARTITION BY KEY (`id`) PARTITIONS 4 */")
+        structure, indexes, primary_key, foreign_keys = backup.Backup.separate_structure_and_indexes(create, rocksdb=True)
+        self.assertIn('SET session rocksdb_bulk_load_allow_unsorted=1;', structure)
+        self.assertIn("CREATE TABLE `events` (\n`id` int NOT NULL,\n  `ref` int DEFAULT NULL,\nKEY `ref_idx` (`ref`))\n "
+                      "ENGINE=ROCKSDB DEFAULT CHARSET=utf8mb4;", structure)
+        self.assertEqual((indexes, primary_key), (None, None))
+        self.assertEqual(foreign_keys, "ALTER TABLE `events` ADD CONSTRAINT `fk_ref` FOREIGN KEY (`ref`) REFERENCES `users` (`id`);")
+
+    def test_rocksdb_partitioned_table_without_indexes_is_closed(self):
+        create = ("CREATE TABLE `events` (\n  `id` int NOT NULL,\n  `msg` text\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4\n"
+                  "/*!50100 PARTITION BY KEY (`id`) PARTITIONS 4 */")
+        structure = backup.Backup.separate_structure_and_indexes(create, rocksdb=True)[0]
+        self.assertIn("CREATE TABLE `events` (\n`id` int NOT NULL,\n  `msg` text\n) ENGINE=ROCKSDB DEFAULT CHARSET=utf8mb4;", structure)
+
+
+class EncodeRowsTest(unittest.TestCase):
+    def test_line_feed_in_enclosed_field_is_escaped(self):
+        block = b''.join(backup.encode_rows([[(b'line1\nline2', b'5')]], enclosed=[True, False]))
+        self.assertEqual(block, b'"line1\\\nline2";5\n')
+        counter = backup.RowCounter()
+        counter.add(block)
+        self.assertEqual(counter.rows, 1)
+
+    def test_tab_separated_field(self):
+        block = b''.join(backup.encode_rows([[(b'a\tb\\', None)]]))
+        self.assertEqual(block, b'a\\\tb\\\\\t\\N\n')
+
+
+if __name__ == '__main__':
+    unittest.main()